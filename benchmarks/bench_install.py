@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+'''Benchmark install.py against a local stand-in for construct's packages.
+
+Fixture packages mimicking the dependency graph in setup.py are created as
+local git repositories and a local wheel index, so every run is independent
+of GitHub and PyPI. Each benchmark round runs the following scenarios with
+install.py in a fresh install directory.
+
+    cold       Install version A with an empty wheel cache
+    warm       Install version A again under a new name
+    upgrade    Install version B, which bumps construct_maya, incrementally
+    reinstall  Install version B again under the same name
+
+Wall times for each scenario and each install step are read from the
+install_report.json written by install.py. The median of all rounds is
+compared against a stored baseline.
+
+Usage:
+    python benchmarks/bench_install.py --save
+    python benchmarks/bench_install.py --rounds 3 --jobs 4
+'''
+from __future__ import print_function
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+REPO_DIR = os.path.dirname(THIS_DIR)
+INSTALL_PY = os.path.join(REPO_DIR, 'install.py')
+SETUP_PY = os.path.join(REPO_DIR, 'setup.py')
+DEFAULT_BASELINE = os.path.join(THIS_DIR, 'baseline.json')
+BUILD_TOOLS = ['setuptools', 'wheel']
+SCENARIOS = ['cold', 'warm', 'upgrade', 'reinstall']
+UPGRADED_PACKAGE = 'construct_maya'
+FIXTURE_SETUP = '''from setuptools import setup
+setup(
+    name={name!r},
+    version={version!r},
+    packages=[{name!r}],
+    install_requires={requires!r},
+    entry_points={entry_points!r},
+)
+'''
+
+
+def log(message, *args):
+    print(message % args)
+    sys.stdout.flush()
+
+
+def git(cwd, *args):
+    subprocess.check_call(
+        ['git', '-c', 'user.name=bench', '-c', 'user.email=bench@localhost']
+        + list(args),
+        cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+
+def read_dependencies(setup_py=SETUP_PY):
+    '''Read the git and pip requirements declared in setup.py.
+
+    Returns a tuple of lists, [(package, version)] and [package].
+    '''
+
+    with open(setup_py, 'r') as f:
+        source = f.read()
+    git_requires = re.findall(
+        r"requires\.git\('[^']+', '([^']+)', '([^']+)'\)",
+        source,
+    )
+    pip_requires = re.findall(r"requires\.pip\('([^']+)'\)", source)
+    return git_requires, pip_requires
+
+
+def write_package(root, name, version, modules, requires=(), scripts=False):
+    '''Write a fixture package with a number of generated modules.'''
+
+    package_dir = os.path.join(root, name)
+    if os.path.isdir(package_dir):
+        shutil.rmtree(package_dir)
+    os.makedirs(package_dir)
+
+    with open(os.path.join(package_dir, '__init__.py'), 'w') as f:
+        f.write('__version__ = %r\n\n\ndef main():\n    pass\n' % version)
+    for i in range(modules):
+        with open(os.path.join(package_dir, 'module_%03d.py' % i), 'w') as f:
+            f.write('# %s %s\n' % (name, version))
+            for j in range(20):
+                f.write(
+                    'def function_%d(value):\n'
+                    '    return value * %d\n\n\n' % (j, i * j)
+                )
+
+    entry_points = {}
+    if scripts:
+        entry_points['console_scripts'] = ['%s=%s:main' % (name, name)]
+    with open(os.path.join(root, 'setup.py'), 'w') as f:
+        f.write(FIXTURE_SETUP.format(
+            name=name,
+            version=version,
+            requires=list(requires),
+            entry_points=entry_points,
+        ))
+
+
+class Fixtures(object):
+    '''Local git repositories and wheel index standing in for GitHub and PyPI.
+
+    Arguments:
+        root (str): Directory to create the fixtures in
+        modules (int): Number of modules in each fixture package
+        find_links (list): Directories containing setuptools and wheel wheels
+    '''
+
+    def __init__(self, root, modules, find_links):
+        self.root = root
+        self.modules = modules
+        self.find_links = find_links
+        self.repos = os.path.join(root, 'repos')
+        self.index = os.path.join(root, 'index')
+        self.versions = {}
+
+    def create(self):
+        git_requires, pip_requires = read_dependencies()
+        os.makedirs(self.repos)
+        os.makedirs(self.index)
+        self.create_index(pip_requires)
+
+        upgraded = []
+        for package, version in git_requires:
+            self.create_repo(package, version)
+            if package == UPGRADED_PACKAGE:
+                version = self.bump(package, version)
+            upgraded.append((package, version))
+
+        self.versions['A'] = self.create_setup('A', git_requires, pip_requires)
+        self.versions['B'] = self.create_setup('B', upgraded, pip_requires)
+
+    def create_index(self, pip_requires):
+        '''Fill the local index with build tools and pip requirements.'''
+
+        for link in self.find_links:
+            for f in os.listdir(link):
+                name = re.split('[-_]', f)[0].lower()
+                if f.endswith('.whl') and name in BUILD_TOOLS + ['packaging']:
+                    shutil.copy2(os.path.join(link, f), self.index)
+
+        indexed = os.listdir(self.index)
+        if not any(f.startswith(tuple(BUILD_TOOLS)) for f in indexed):
+            log('Downloading build tools %s...', ', '.join(BUILD_TOOLS))
+            subprocess.check_call(
+                [sys.executable, '-m', 'pip', 'download', '-q', '-d',
+                 self.index] + BUILD_TOOLS
+            )
+
+        for package in pip_requires:
+            src = os.path.join(self.root, 'src', package)
+            write_package(src, package, '1.0.0', self.modules)
+            subprocess.check_call(
+                [sys.executable, '-m', 'pip', 'wheel', '-q', '--no-deps',
+                 '--no-index', '--find-links', self.index, '-w', self.index,
+                 src],
+            )
+
+    def create_repo(self, package, version):
+        repo = os.path.join(self.repos, package)
+        write_package(repo, package, version, self.modules, scripts=True)
+        git(repo, 'init', '-q')
+        git(repo, 'add', '-A')
+        git(repo, 'commit', '-q', '-m', version)
+        git(repo, 'tag', version)
+
+    def bump(self, package, version):
+        '''Tag a new patch version of a fixture package.'''
+
+        parts = version.split('.')
+        parts[-1] = str(int(parts[-1]) + 1)
+        new_version = '.'.join(parts)
+
+        repo = os.path.join(self.repos, package)
+        write_package(repo, package, new_version, self.modules, scripts=True)
+        git(repo, 'commit', '-q', '-a', '-m', new_version)
+        git(repo, 'tag', new_version)
+        return new_version
+
+    def create_setup(self, label, git_requires, pip_requires):
+        '''Write a construct_setup source tree for a set of pins.'''
+
+        requires = [
+            '{0} @ git+file://localhost{1}/{0}@{2}#egg={0}-{2}'.format(
+                package,
+                self.repos.replace('\\', '/'),
+                version,
+            )
+            for package, version in git_requires
+        ] + list(pip_requires)
+
+        src = os.path.join(self.root, 'construct_setup_' + label)
+        os.makedirs(src)
+        with open(os.path.join(src, 'setup.py'), 'w') as f:
+            f.write(
+                'from setuptools import setup\n'
+                'setup(name="construct_setup", version="0.0.0+%s", '
+                'install_requires=%r)\n' % (label.lower(), requires)
+            )
+        return src
+
+
+def run_install(fixtures, where, home, version, name, args):
+    '''Run install.py and return its report, or None if it failed.'''
+
+    env = dict(os.environ)
+    env.update({
+        'HOME': home,
+        'SCRIM_ADMIN': '0',
+        'PIP_NO_INDEX': '1',
+        'PIP_FIND_LINKS': fixtures.index,
+        'PIP_DISABLE_PIP_VERSION_CHECK': '1',
+    })
+    env.pop('SCRIM_PATH', None)
+    cmd = [
+        sys.executable, INSTALL_PY,
+        '--local',
+        '--where', where,
+        '--name', name,
+    ] + args
+
+    start = time.time()
+    proc = subprocess.Popen(
+        cmd,
+        cwd=fixtures.versions[version],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    output = proc.communicate()[0]
+    wall = time.time() - start
+    report_path = os.path.join(where, name, 'install_report.json')
+    if proc.returncode != 0 or not os.path.isfile(report_path):
+        log('%s failed:\n%s', ' '.join(cmd), output.decode('utf-8', 'replace'))
+        return
+
+    with open(report_path, 'r') as f:
+        report = json.load(f)
+
+    steps = []
+    for step in report['steps']:
+        step_name = re.sub(r'^\d+\. ', '', step['name'])
+        step_name = step_name.replace(where.replace('\\', '/'), '<where>')
+        steps.append([step_name, step.get('wall', 0)])
+    return {'total': wall, 'steps': steps}
+
+
+def run_round(fixtures, root, args):
+    '''Run every scenario once in a fresh install directory.'''
+
+    where = os.path.join(root, 'where')
+    home = os.path.join(root, 'home')
+    for folder in (where, home):
+        if os.path.isdir(folder):
+            shutil.rmtree(folder)
+        os.makedirs(folder)
+
+    install_args = ['--jobs', str(args.jobs)] + args.install_args
+    scenarios = [
+        ('cold', 'A', 'cold', install_args),
+        ('warm', 'A', 'warm', install_args),
+        ('upgrade', 'B', 'upgrade', install_args + ['--incremental']),
+        ('reinstall', 'B', 'upgrade', install_args),
+    ]
+    results = {}
+    for scenario, version, name, scenario_args in scenarios:
+        log('    %s...', scenario)
+        result = run_install(
+            fixtures,
+            where,
+            home,
+            version,
+            name,
+            scenario_args,
+        )
+        if result is None:
+            return
+        results[scenario] = result
+    return results
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def summarize(rounds):
+    '''Get the median total and step times of each scenario.'''
+
+    summary = {}
+    for scenario in SCENARIOS:
+        results = [r[scenario] for r in rounds]
+        step_names = []
+        for result in results:
+            for step, _ in result['steps']:
+                if step not in step_names:
+                    step_names.append(step)
+        step_walls = [dict(result['steps']) for result in results]
+        summary[scenario] = {
+            'total': median([r['total'] for r in results]),
+            'steps': [
+                [step, median([walls.get(step, 0) for walls in step_walls])]
+                for step in step_names
+            ],
+        }
+    return summary
+
+
+def compare(summary, baseline, threshold, show_steps):
+    '''Print summary next to baseline and return a list of regressions.'''
+
+    regressions = []
+    row = '{0:<48} {1:>9} {2:>9} {3:>8}'
+    print()
+    print(row.format('scenario', 'seconds', 'baseline', 'change'))
+    for scenario in SCENARIOS:
+        rows = [(scenario, summary[scenario]['total'],
+                 baseline.get(scenario, {}).get('total'))]
+        if show_steps:
+            base_steps = dict(baseline.get(scenario, {}).get('steps', []))
+            for step, wall in summary[scenario]['steps']:
+                rows.append(('    ' + step[:44], wall, base_steps.get(step)))
+
+        for label, value, base in rows:
+            change = ''
+            if base:
+                ratio = (value - base) / base
+                change = '%+.0f%%' % (ratio * 100)
+                if ratio > threshold and not label.startswith(' '):
+                    regressions.append(label)
+            print(row.format(
+                label,
+                '%.2f' % value,
+                '%.2f' % base if base else '-',
+                change,
+            ))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rounds', type=int, default=1)
+    parser.add_argument('--jobs', type=int, default=4)
+    parser.add_argument(
+        '--modules',
+        type=int,
+        default=50,
+        help='Number of modules in each fixture package.',
+    )
+    parser.add_argument(
+        '--find-links',
+        action='append',
+        default=[],
+        help='Directory containing setuptools and wheel wheels.',
+    )
+    parser.add_argument(
+        '--install-args',
+        default='',
+        help='Extra arguments passed to install.py.',
+    )
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument(
+        '--save',
+        action='store_true',
+        help='Save the results as the new baseline.',
+    )
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.2,
+        help='Fail if a scenario is slower than the baseline by this ratio.',
+    )
+    parser.add_argument(
+        '--steps',
+        action='store_true',
+        help='Show per step timings.',
+    )
+    parser.add_argument('--keep', action='store_true')
+    args = parser.parse_args()
+    args.install_args = args.install_args.split()
+
+    root = tempfile.mkdtemp(prefix='construct_bench_')
+    try:
+        log('Creating fixtures in %s...', root)
+        fixtures = Fixtures(
+            os.path.join(root, 'fixtures'),
+            args.modules,
+            args.find_links,
+        )
+        fixtures.create()
+
+        rounds = []
+        for i in range(args.rounds):
+            log('Round %d of %d', i + 1, args.rounds)
+            results = run_round(fixtures, os.path.join(root, 'run'), args)
+            if results is None:
+                return 1
+            rounds.append(results)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    summary = summarize(rounds)
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    regressions = compare(summary, baseline, args.threshold, args.steps)
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(summary, f, indent=4, sort_keys=True)
+        log('\nSaved baseline to %s.', args.baseline)
+    elif regressions:
+        log('\nSlower than baseline: %s', ', '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,7 +4,7 @@ set THIS=%~dp0
 set OLD_PATH=%PATH%
 set OLD_PYTHONPATH=%PYTHONPATH%
 set PATH=%THIS%\current\bin;%THIS%\current\python\Scripts;%PATH%
-set PYTHONPATH=%THIS%\current\lib;%PYTHONPATH%
+set PYTHONPATH=%THIS%\current\lib.zip;%THIS%\current\lib;%PYTHONPATH%
 
 
 call %THIS%\current\bin\construct.bat %*
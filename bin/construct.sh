@@ -2,7 +2,7 @@
 
 THIS="$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 && pwd )"
 export PATH="$THIS/current/bin:$THIS/current/python/bin:$PATH"
-export PYTHONPATH="$THIS/current/lib:$PYTHONPATH"
+export PYTHONPATH="$THIS/current/lib.zip:$THIS/current/lib:$PYTHONPATH"
 
 py_entry_point="$THIS/current/bin/construct"
 source $py_entry_point
@@ -10,8 +10,22 @@ source $py_entry_point
 alias cons=construct
 
 
+_cons_replace_link () {
+    # Rename a new symlink over an existing one so it always exists
+    ln -sfn "$1" "$THIS/.$2.tmp"
+    mv -Tf "$THIS/.$2.tmp" "$THIS/$2" 2>/dev/null ||
+        mv -hf "$THIS/.$2.tmp" "$THIS/$2"
+}
+
+
 cons_set_version () {
     # Set active construct version
-    rm "$THIS/current"
-    ln -s "$THIS/$1" "$THIS/current"
+    if [ ! -d "$THIS/$1" ]; then
+        echo "Construct version $1 is not installed in $THIS."
+        return 1
+    fi
+    if [ -e "$THIS/current" ]; then
+        _cons_replace_link "$(cd "$THIS/current" && pwd -P)" previous
+    fi
+    _cons_replace_link "$THIS/$1" current
 }
@@ -3,23 +3,45 @@ from __future__ import print_function
 import sys
 import platform
 import argparse
+import binascii
+import collections
+import csv
+import errno
+import hashlib
+import io
+import json
 from contextlib import contextmanager
-from subprocess import check_call, check_output, PIPE, Popen
+from stat import S_ISREG
+from subprocess import check_call, check_output, PIPE, Popen, STDOUT
 import os
 import re
 import shutil
 import logging
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows
 
 PY2 = sys.version_info[0] == 2
 PY3 = sys.version_info[0] == 3
 if PY2:
+    import Queue as queue
     input = raw_input
+else:
+    import queue
 
 # Configure Logging
 logging.basicConfig(format='%(levelname)-8s | %(message)s')
 _log = logging.getLogger('construct_setup')
-_indent = ''
+_context = threading.local()  # Log indent, step and output of each thread
 _count = 1
+_log_lock = threading.Lock()
+_main_thread = threading.current_thread()
 
 debug = _log.debug
 critical = _log.critical
@@ -29,13 +51,32 @@ warning = _log.warning
 exception = _log.exception
 
 
+class AbortError(Exception):
+    '''Raised by abort outside of the main thread.'''
+
+
 def log(message, *args, **kwargs):
-    print((_indent + message) % args, **kwargs)
+    write_output((get_indent() + message) % args, **kwargs)
+    _events.emit('installer', message.strip('\n') % args)
+
+
+def write_output(text, stream=None, **kwargs):
+    '''Print text, or hold it until the current step's output is shown.'''
+
+    output = getattr(_context, 'output', None)
+    if output is not None:
+        output.write(text, stream, **kwargs)
+        return
+    with _log_lock:
+        print(text, file=stream, **kwargs)
+
+
+def get_indent():
+    return getattr(_context, 'indent', '')
 
 
 def set_indent(string):
-    global _indent
-    _indent = string
+    _context.indent = string
 
 
 def set_step(value):
@@ -43,28 +84,369 @@ def set_step(value):
     _count = value
 
 
+def get_context():
+    '''Get the log context of this thread to pass to threads it starts.'''
+
+    return dict(_context.__dict__)
+
+
+def set_context(context):
+    '''Use a log context returned by get_context in this thread.'''
+
+    _context.__dict__.update(context)
+
+
+class StepOutputFilter(logging.Filter):
+    '''Holds log records written by a step until its output is shown.'''
+
+    def __init__(self, handler):
+        super(StepOutputFilter, self).__init__()
+        self.handler = handler
+
+    def filter(self, record):
+        output = getattr(_context, 'output', None)
+        if output is None:
+            return True
+        output.write(self.handler.format(record), self.handler.stream)
+        return False
+
+
+for _handler in logging.root.handlers:
+    _handler.addFilter(StepOutputFilter(_handler))
+
+
 def abort(message, *args):
+    if threading.current_thread() is not _main_thread:
+        # Only the main thread can exit, it aborts when it gets the error
+        raise AbortError(message % args)
     exception(message, *args)
+    cancel_commands()
     set_indent('')
+    tail = _events.tail()
+    if tail:
+        log('\nLast output of step %s\n', _events.step)
+        for line in tail:
+            log('    %s', line)
     log('\nInstall Aborted.')
-    sys.exit()
+    _tracer.save()
+    _events.close()
+    sys.exit(1)
 
 
 @contextmanager
 def step(message, *args, **kwargs):
     msg = message % args
+    _events.step = str(_count) + '. ' + msg
     log(('\n' + str(_count) + '. ' + message) % args)
+    record = _tracer.begin_step(str(_count) + '. ' + msg)
     try:
         set_indent('    ')
         yield
         log('OK!')
+        _tracer.end_step(record, 'ok')
     except Exception as e:
+        _tracer.end_step(record, 'failed')
         abort('Install step failed...')
     finally:
+        _tracer.end_step(record, 'aborted')
         set_indent('')
         set_step(_count + 1)
 
 
+# Tracing
+def get_usage():
+    '''Get the resource usage of this process and its children.
+
+    Returns a dict with cpu time in seconds, peak rss of this process in
+    bytes and bytes written. Only cpu time is available on Windows.
+    '''
+
+    if not resource:
+        times = os.times()
+        return {'cpu': times[0] + times[1], 'max_rss': 0, 'written': 0}
+
+    usage = {'cpu': 0.0, 'max_rss': 0, 'written': 0}
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        rusage = resource.getrusage(who)
+        usage['cpu'] += rusage.ru_utime + rusage.ru_stime
+        usage['written'] += rusage.ru_oublock * 512
+        if who == resource.RUSAGE_SELF:
+            # Children's peak is recorded per command by Command
+            usage['max_rss'] = get_max_rss(rusage)
+    return usage
+
+
+def get_max_rss(rusage):
+    '''Peak rss of an rusage in bytes, MacOS reports bytes not kilobytes.'''
+
+    if sys.platform == 'darwin':
+        return rusage.ru_maxrss
+    return rusage.ru_maxrss * 1024
+
+
+class Tracer(object):
+    '''Records the timing and resource usage of install steps and commands.
+
+    The records are written to a JSON report and optionally to a Chrome
+    trace event file that can be opened in chrome://tracing or Perfetto.
+    '''
+
+    def __init__(self):
+        self.info = {}
+        self.steps = []
+        self.report_path = None
+        self.trace_path = None
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+        self._threads = {}
+
+    def begin(self, report_path, trace_path=None, **info):
+        '''Start recording, save will write to report_path and trace_path.'''
+
+        self.info = info
+        self.steps = []
+        self.report_path = report_path
+        self.trace_path = trace_path
+        self.start_time = time.time()
+
+    def begin_step(self, name):
+        record = {
+            'name': name,
+            'status': None,
+            'start': time.time() - self.start_time,
+            'commands': [],
+            '_usage': get_usage(),
+        }
+        with self._lock:
+            self.steps.append(record)
+        return record
+
+    def end_step(self, record, status):
+        if record['status']:
+            return
+
+        usage = get_usage()
+        start_usage = record.pop('_usage')
+        record['status'] = status
+        record['wall'] = time.time() - self.start_time - record['start']
+        record['cpu'] = usage['cpu'] - start_usage['cpu']
+        record['written'] = usage['written'] - start_usage['written']
+        record['max_rss'] = max(
+            [usage['max_rss']] +
+            [cmd['max_rss'] for cmd in record['commands']]
+        )
+
+    def command(self, cmd, start, returncode, usage=None):
+        '''Record a command run by the current step.'''
+
+        usage = usage or {'cpu': 0, 'max_rss': 0, 'written': 0}
+        record = {
+            'cmd': cmd,
+            'returncode': returncode,
+            'start': start - self.start_time,
+            'wall': time.time() - start,
+            'thread': self._thread_id(),
+        }
+        record.update(usage)
+        with self._lock:
+            open_steps = [s for s in self.steps if not s['status']]
+            # Steps run at the same time, prefer this thread's step
+            steps = [s for s in open_steps if s['name'] == _events.step]
+            steps = steps or open_steps
+            if steps:
+                steps[-1]['commands'].append(record)
+
+    def _thread_id(self):
+        ident = threading.current_thread().ident
+        with self._lock:
+            return self._threads.setdefault(ident, len(self._threads))
+
+    def report(self):
+        '''Get the report as a dict.'''
+
+        steps = []
+        for step in self.steps:
+            step = dict(step)
+            if not step['status']:
+                step.pop('_usage', None)
+                step['status'] = 'aborted'
+            steps.append(step)
+
+        report = dict(self.info)
+        report['started'] = self.start_time
+        report['wall'] = time.time() - self.start_time
+        report['steps'] = steps
+        return report
+
+    def trace(self, report):
+        '''Convert a report to Chrome trace events.'''
+
+        events = [{
+            'name': 'thread_name',
+            'ph': 'M',
+            'pid': 1,
+            'tid': 0,
+            'args': {'name': 'steps'},
+        }]
+        for step in report['steps']:
+            events.append({
+                'name': step['name'],
+                'cat': 'step',
+                'ph': 'X',
+                'pid': 1,
+                'tid': 0,
+                'ts': int(step['start'] * 1000000),
+                'dur': int(step.get('wall', 0) * 1000000),
+                'args': dict(
+                    (k, v) for k, v in step.items()
+                    if k not in ('name', 'start', 'wall', 'commands')
+                ),
+            })
+            for cmd in step['commands']:
+                events.append({
+                    'name': cmd['cmd'][:80],
+                    'cat': 'command',
+                    'ph': 'X',
+                    'pid': 1,
+                    'tid': cmd['thread'] + 1,
+                    'ts': int(cmd['start'] * 1000000),
+                    'dur': int(cmd['wall'] * 1000000),
+                    'args': cmd,
+                })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self):
+        '''Write the report and trace if recording was started.'''
+
+        if not self.report_path:
+            return
+
+        report = self.report()
+        outputs = [(self.report_path, report)]
+        if self.trace_path:
+            outputs.append((self.trace_path, self.trace(report)))
+        for path, data in outputs:
+            if not os.path.isdir(os.path.dirname(path)):
+                continue
+            with open(path, 'w') as f:
+                json.dump(data, f, indent=4, sort_keys=True)
+
+
+_tracer = Tracer()
+
+
+# Event Log
+LOG_TAIL_LINES = 50
+
+
+class EventLog(object):
+    '''Writes install events to a JSON lines file on a background thread.
+
+    Each event records the time, the current step, its source and a
+    message. The source is "installer" for log messages, "stdout" or
+    "stderr" for a line of command output and "exit" for a command's return
+    code. The last lines of command output of each step are kept so abort
+    can show why a step failed.
+    '''
+
+    def __init__(self, tail_size=LOG_TAIL_LINES):
+        self.path = None
+        self.tail_size = tail_size
+        self.tails = {}
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def begin(self, path):
+        '''Start writing events to path.
+
+        Events are held until the folder containing path exists.
+        '''
+
+        self.close()
+        self.path = path
+        self.tails = {}
+        self._thread = threading.Thread(target=self._write, args=(path,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def step(self):
+        '''The step of the current thread.'''
+
+        return getattr(_context, 'step', None)
+
+    @step.setter
+    def step(self, value):
+        _context.step = value
+
+    def emit(self, source, message, **fields):
+        event = {
+            'time': time.time(),
+            'step': self.step,
+            'source': source,
+            'message': message,
+        }
+        event.update(fields)
+        if source in ('stdout', 'stderr'):
+            with self._lock:
+                if self.step not in self.tails:
+                    self.tails[self.step] = collections.deque(
+                        maxlen=self.tail_size
+                    )
+                self.tails[self.step].append(message)
+        if self._thread:
+            self._queue.put(event)
+
+    def tail(self, step=None):
+        '''Get the last lines of command output of a step.'''
+
+        with self._lock:
+            return list(self.tails.get(step or self.step, []))
+
+    def close(self):
+        '''Write all pending events and stop the writer thread.'''
+
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _write(self, path):
+        pending = []
+        f = None
+        while True:
+            event = self._queue.get()
+            if event is not None:
+                pending.append(event)
+            if f is None and os.path.isdir(os.path.dirname(path)):
+                f = open(path, 'a')
+            # Write in batches whenever the queue is drained
+            if f and pending and (event is None or self._queue.empty()):
+                f.write(''.join(json.dumps(e) + '\n' for e in pending))
+                f.flush()
+                pending = []
+            if event is None:
+                break
+        if f:
+            f.close()
+
+
+class EventLogHandler(logging.Handler):
+    '''Sends log records to the event log.'''
+
+    def emit(self, record):
+        _events.emit(
+            'installer',
+            record.getMessage(),
+            level=record.levelname.lower(),
+        )
+
+
+_events = EventLog()
+_log.addHandler(EventLogHandler())
+
+
 # Configure Globals
 THIS_DIR = os.path.abspath(os.path.dirname(__file__))
 THIS_BIN = os.path.join(THIS_DIR, 'bin')
@@ -76,6 +458,12 @@ DEFAULT_INSTALL_DIR = {
 }[PLATFORM]
 DEFAULT_VERSION = '0.1.40'
 DEFAULT_PYTHON = sys.executable
+DEFAULT_JOBS = 1
+DEFAULT_CACHE_SIZE = 2048  # Megabytes
+DEFAULT_BYTECODE = 'checked-hash'
+BYTECODE_MODES = ['checked-hash', 'unchecked-hash', 'timestamp', 'none']
+DEFAULT_LATENCY_BUDGET = 5.0  # Seconds
+CACHE_LATEST_TTL = 24 * 60 * 60  # Seconds before unpinned wheels expire
 VERBOSE = False
 PIP_PACKAGE = (
     'git+https://github.com/construct-org/construct_setup'
@@ -198,46 +586,368 @@ def escape(path):
     return path
 
 
-def run(cmd, abort_on_fail=True, **kwargs):
-    '''Run a shell command and return True if it succeeds.'''
+WAIT_INTERVAL = 0.5  # Seconds between checks for Ctrl-C while waiting
 
-    kwargs.setdefault('shell', True)
-    if not VERBOSE:
-        kwargs.setdefault('stderr', PIPE)
+
+def parallel_map(func, items, jobs):
+    '''Call func for each item using at most jobs worker threads.
+
+    Returns a list of (result, exception) tuples in the same order as items.
+    '''
+
+    items = list(items)
+    results = [(None, None)] * len(items)
+    work = queue.Queue()
+    for i, item in enumerate(items):
+        work.put((i, item))
+    context = get_context()
+
+    def worker():
+        set_context(context)
+        while True:
+            try:
+                i, item = work.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[i] = (func(item), None)
+            except Exception as e:
+                results[i] = (None, e)
+
+    workers = []
+    for _ in range(max(1, min(jobs, len(items)))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        workers.append(thread)
+    try:
+        for thread in workers:
+            # Join with a timeout so Ctrl-C interrupts the wait on Python 2
+            while thread.is_alive():
+                thread.join(WAIT_INTERVAL)
+    except KeyboardInterrupt:
+        while not work.empty():
+            try:
+                work.get_nowait()
+            except queue.Empty:
+                break
+        interrupt_commands()
+        raise
+
+    return results
+
+
+# Commands
+LOG_LINE_LIMIT = 4096  # Longer lines are split to bound memory
+COMMAND_TIMEOUT = None  # Seconds, set by --timeout
+_commands = set()
+_commands_lock = threading.Lock()
+_interrupted = threading.Event()
+
+
+class Command(object):
+    '''A subprocess whose output is streamed to the event log.
+
+    Both pipes are read line by line and only the last LOG_TAIL_LINES lines
+    of at most LOG_LINE_LIMIT bytes are kept, so memory use does not grow
+    with a command's output. The command and its children are killed when
+    it runs longer than timeout seconds or is cancelled. Pass a list to run
+    cmd without a shell.
+    '''
+
+    def __init__(self, cmd, timeout=None, **kwargs):
+        kwargs.setdefault('shell', not isinstance(cmd, (list, tuple)))
         kwargs.setdefault('stdout', PIPE)
+        kwargs.setdefault('stderr', PIPE)
+        if PLATFORM != 'Windows':
+            # Start a process group so kill reaches the shell's children
+            if PY2:
+                kwargs.setdefault('preexec_fn', os.setsid)
+            else:
+                kwargs.setdefault('start_new_session', True)
+        self.cmd = cmd
+        if isinstance(cmd, (list, tuple)):
+            self.name = ' '.join(cmd)
+        else:
+            self.name = cmd
+        if timeout is None:
+            timeout = COMMAND_TIMEOUT
+        self.timeout = timeout
+        self.kwargs = kwargs
+        self.proc = None
+        self.returncode = None
+        self.stdout = None
+        self.stderr = None
+        self.usage = None
+        self.timed_out = False
+        self.cancelled = False
+        self._readers = []
+        self._context = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        if _interrupted.is_set():
+            raise AbortError('Interrupted, not running: %s' % self.name)
+        self._context = get_context()
+        self.proc = Popen(self.cmd, **self.kwargs)
+        with _commands_lock:
+            _commands.add(self)
+        for name in ('stdout', 'stderr'):
+            pipe = getattr(self.proc, name)
+            if pipe:
+                reader = threading.Thread(target=self._read, args=(name, pipe))
+                reader.daemon = True
+                reader.start()
+                self._readers.append(reader)
+        return self
+
+    def wait(self):
+        '''Wait for the command to exit and return its returncode.'''
+
+        timer = None
+        if self.timeout:
+            timer = threading.Timer(self.timeout, self._expire)
+            timer.daemon = True
+            timer.start()
+        try:
+            for reader in self._readers:
+                reader.join()
+            self._reap()
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+        finally:
+            if timer:
+                timer.cancel()
+            with _commands_lock:
+                _commands.discard(self)
+
+        _events.emit('exit', str(self.returncode), cmd=self.name)
+        return self.returncode
+
+    def run(self):
+        '''Start the command, wait for it and record it with the tracer.'''
+
+        start = time.time()
+        self.start()
+        self.wait()
+        _tracer.command(self.name, start, self.returncode, self.usage)
+        return self.returncode
+
+    def cancel(self):
+        '''Kill the command and its children.'''
+
+        self.cancelled = True
+        self._kill()
+
+    def _expire(self):
+        self.timed_out = True
+        self._kill()
+
+    def _kill(self):
+        with self._lock:
+            if self.proc is None or self.returncode is not None:
+                return
+            try:
+                if PLATFORM == 'Windows':
+                    check_call(
+                        'taskkill /F /T /PID %d' % self.proc.pid,
+                        stdout=PIPE,
+                        stderr=PIPE,
+                    )
+                else:
+                    os.killpg(self.proc.pid, 9)
+            except Exception:
+                try:
+                    self.proc.kill()
+                except OSError:
+                    pass
+
+    def _read(self, name, pipe):
+        set_context(self._context)
+        tail = collections.deque(maxlen=LOG_TAIL_LINES)
+        for line in iter(lambda: pipe.readline(LOG_LINE_LIMIT), b''):
+            line = line.decode('utf-8', 'replace').rstrip('\r\n')
+            tail.append(line)
+            _events.emit(name, line, cmd=self.name)
+            if VERBOSE:
+                write_output(line)
+        pipe.close()
+        setattr(self, name, '\n'.join(tail))
+
+    def _reap(self):
+        # Use wait4 where available to record the command's resource usage
+        if not hasattr(os, 'wait4'):
+            returncode = self.proc.wait()
+        else:
+            _, status, rusage = os.wait4(self.proc.pid, 0)
+            if os.WIFSIGNALED(status):
+                returncode = -os.WTERMSIG(status)
+            else:
+                returncode = os.WEXITSTATUS(status)
+            self.proc.returncode = returncode
+            self.usage = {
+                'cpu': rusage.ru_utime + rusage.ru_stime,
+                'max_rss': get_max_rss(rusage),
+                'written': rusage.ru_oublock * 512,
+            }
+        with self._lock:
+            self.returncode = returncode
+
+
+def run_commands(commands, jobs):
+    '''Run a list of Commands using at most jobs worker threads.
+
+    Each Command keeps its own output. Returns the commands once all of them
+    have finished.
+    '''
+
+    for _, exc in parallel_map(lambda command: command.run(), commands, jobs):
+        if exc:
+            raise exc
+    return commands
+
+
+def cancel_commands():
+    '''Kill all running commands.'''
+
+    with _commands_lock:
+        commands = list(_commands)
+    for command in commands:
+        command.cancel()
+
+
+def interrupt_commands():
+    '''Kill all running commands and refuse to start new ones.
+
+    Commands run in their own process group so Ctrl-C does not reach them,
+    this is called when the user interrupts the install.
+    '''
+
+    _interrupted.set()
+    cancel_commands()
+
+
+def run(cmd, abort_on_fail=True, timeout=None, **kwargs):
+    '''Run a shell command and return True if it succeeds.
+
+    Pass timeout to kill the command after that many seconds, defaults to
+    COMMAND_TIMEOUT.
+    '''
 
     log('%s', cmd)
-    proc = Popen(cmd, **kwargs)
-    stdout, stderr = proc.communicate()
+    command = Command(cmd, timeout, **kwargs)
+    command.run()
 
-    if proc.returncode != 0:
+    if command.returncode != 0:
         if abort_on_fail:
+            if command.timed_out:
+                abort(
+                    'Timed out after %s seconds: %s',
+                    command.timeout,
+                    cmd,
+                )
             abort('Failed to execute: %s', cmd)
         return False
 
-    return stdout, stderr
+    return command.stdout, command.stderr
+
+
+PROBE_SCRIPT = '''
+import json, os, sys, sysconfig
+try:
+    from importlib.util import find_spec
+except ImportError:
+    from pkgutil import find_loader as find_spec
+
+def available(module):
+    try:
+        return find_spec(module) is not None
+    except Exception:
+        return False
+
+scheme = None
+if 'venv' in sysconfig.get_scheme_names():
+    scheme = 'venv'
+elif os.name == 'nt':
+    scheme = 'nt'
+else:
+    scheme = 'posix_prefix'
+env = os.path.abspath('env')
+site = sysconfig.get_path('purelib', scheme, {'base': env, 'platbase': env})
+version = '%d.%d' % sys.version_info[:2]
+platform = sysconfig.get_platform()
+print(json.dumps({
+    'executable': sys.executable,
+    'version': version,
+    'version_info': list(sys.version_info[:3]),
+    'platform': platform,
+    'python_tag': 'py%s-%s' % (version, platform),
+    'site_packages': os.path.relpath(site, env).replace(os.sep, '/'),
+    'pip': available('pip'),
+    'venv': available('venv') and available('ensurepip'),
+    'virtualenv': available('virtualenv'),
+}))
+'''
+_probes = {}
+
+
+def probe_python(python):
+    '''Probe a python interpreter's capabilities in a single process.
+
+    The result is cached so each interpreter is only started once per run.
+    Returns a dict containing the interpreter's version, platform, python_tag,
+    the site_packages path of its virtualenvs relative to the env and whether
+    the pip, venv and virtualenv modules are available.
+
+    Raises OSError if the interpreter could not be run.
+    '''
+
+    if python in _probes:
+        return _probes[python]
+
+    debug('Probing %s', python)
+    proc = Popen(python + ' -', shell=True, stdin=PIPE, stdout=PIPE)
+    output, _ = proc.communicate(PROBE_SCRIPT.encode('utf-8'))
+    if proc.returncode != 0:
+        raise OSError('Failed to run %s' % python)
+    if not isinstance(output, str):
+        output = output.decode('utf-8')
+
+    probe = json.loads(output.strip().splitlines()[-1])
+    probe['python_tag'] = re.sub(r'[^A-Za-z0-9._-]', '_', probe['python_tag'])
+    _probes[python] = probe
+    return probe
 
 
 def get_python_version(python):
     '''Get the python version from a python executable.'''
 
-    return check_output(
-        'python -c "import sys; print(sys.version[:3])"',
-        shell=True
-    ).strip()
+    return probe_python(python)['version']
+
+
+def get_python_tag(python):
+    '''Get a tag identifying a python executable's version and platform.'''
+
+    return probe_python(python)['python_tag']
 
 
-def create_venv(python, env_dir, env_py):
-    '''Create a virtualenv using the specified python interpreter.'''
+def create_venv(python, env_dir, env_py, cache=None, find_links=None):
+    '''Create a virtualenv using the specified python interpreter.
+
+    When a WheelCache is provided pip is upgraded from a cached wheel. When
+    find_links is provided pip is upgraded from those directories only.
+    '''
 
     if os.path.exists(env_dir):
         log('Virtualenv already exists %s.', env_dir)
         return
 
     log('Creating virtualenv %s.', env_dir)
-    if is_available(python + ' -c "import virtualenv"'):
+    probe = probe_python(python)
+    if probe['virtualenv']:
         run(python + ' -m virtualenv ' + env_dir)
-    elif is_available(python + ' -c "import venv"'):
+    elif probe['venv']:
         run(python + ' -m venv ' + env_dir)
     else:
         success = run(
@@ -255,330 +965,4236 @@ def create_venv(python, env_dir, env_py):
 
     # Upgrade pip
     log('Upgrading pip...')
+    if find_links is not None:
+        if any(find_wheels(link) for link in find_links):
+            pip_install(
+                env_py,
+                '-U',
+                '--no-index',
+                'pip',
+                find_links=find_links,
+            )
+        return
+    if cache:
+        tmp_dir = tempfile.mkdtemp(prefix='construct_pip_')
+        try:
+            wheel_dir = fetch_wheels(env_py, 'pip', tmp_dir, cache)
+            pip_install(
+                env_py,
+                '-U',
+                '--no-index',
+                'pip',
+                find_links=[wheel_dir],
+            )
+            return
+        except BuildError:
+            warning('Failed to cache pip, upgrading from index.')
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
     pip_install(env_py, '-U', 'pip')
 
 
-def pip_install(python, *args):
-    '''Pip install using the specified python interpreter'''
+def pip_install(python, *args, **kwargs):
+    '''Pip install using the specified python interpreter
 
-    args = [python, '-m', 'pip', 'install'] + list(args)
-    run(' '.join(args), abort_on_fail=True)
+    Pass find_links to search a list of wheel directories for packages and
+    timeout to kill pip after that many seconds.
+    '''
 
+    find_links = kwargs.pop('find_links', None) or []
+    timeout = kwargs.pop('timeout', None)
+    args = [python, '-m', 'pip', 'install'] + list(args)
+    args.extend('--find-links=%s' % escape(link) for link in find_links)
+    run(' '.join(args), abort_on_fail=True, timeout=timeout)
 
-def move_dir(src, dest):
-    '''Move a directory recursively.'''
 
-    if not os.path.isdir(dest):
-        log('Creating %s', dest)
-        os.makedirs(dest)
+def compile_bytecode(python, path, mode=DEFAULT_BYTECODE, ddir=None):
+    '''Compile all python files in path to bytecode in parallel.
 
-    for src_root, subdirs, files in os.walk(src):
-        dest_root = src_root.replace(src, dest)
+    Uses hash based pycs when the interpreter supports them, so bytecode stays
+    valid when files are copied or linked between versions. Pass ddir when
+    path will be moved to record the final path in the bytecode. Returns True
+    if every file compiled.
+    '''
 
-        if not os.path.isdir(dest_root):
-            log('Creating %s', dest_root)
-            os.makedirs(dest_root)
+    args = [python, '-m', 'compileall', '-q']
+    if ddir:
+        args.extend(['-d', escape(ddir)])
+    version = tuple(probe_python(python)['version_info'])
+    if version >= (3, 5):
+        args.extend(['-j', '0'])  # One worker per cpu
+    if version >= (3, 7):
+        args.extend(['--invalidation-mode', mode])
+    args.append(escape(path))
+    return bool(run(' '.join(args), abort_on_fail=False))
+
+
+# Dependency Utilities
+class BuildError(Exception):
+    '''Raised when pip fails to build a wheel for a requirement.'''
+
+    def __init__(self, requirement, output):
+        self.requirement = requirement
+        self.output = output
+        super(BuildError, self).__init__(
+            'Failed to build %s' % requirement
+        )
 
-        for f in files:
-            log('%s > %s', join_path(src_root, f), join_path(dest_root, f))
-            src_path = join_path(src_root, f)
-            dest_path = join_path(dest_root, f)
-            if os.path.exists(dest_path):
-                os.remove(dest_path)
-            os.rename(join_path(src_root, f), join_path(dest_root, f))
 
-    shutil.rmtree(src)
+def normalize_name(name):
+    '''Normalize a project name for comparisons (PEP 503).'''
 
+    return re.sub(r'[-_.]+', '_', name).lower()
 
-def set_user_acls(where):
-    '''Set Windows Ownership and ACLs using powershell'''
 
-    # Irritatingly, Set-Acl doesn't work, we have to use icacls
-    where = escape(where.replace('/', '\\').rstrip('\\'))
-    success = run(
-        'icacls %s\* /grant Users:(F) /inheritance:e /T' % where,
-        abort_on_fail=False,
-    )
-    if not success:
-        error('Failed to set permissions for %s', where)
+def parse_requirement(requirement):
+    '''Split a requirement string into a tuple (name, url, ref).
 
+    Handles "name @ url" and "name==version" requirements as well as bare
+    urls with an #egg= fragment. The ref is the pinned git ref or version,
+    or None when the requirement is not pinned.
+    '''
 
-def update_symlink(src, dest):
-    '''Creates or updates a symlink'''
+    requirement = requirement.split(';', 1)[0].strip()
+    match = re.match(r'([A-Za-z0-9][A-Za-z0-9._-]*)\s*@\s*(.+)$', requirement)
+    if match:
+        name, url = match.groups()
+    elif '://' in requirement:
+        url = requirement
+        match = re.search(r'#egg=([A-Za-z0-9._]+)', url)
+        name = match.group(1) if match else url.rstrip('/').split('/')[-1]
+    elif requirement.startswith('.') or re.search(r'[/\\]', requirement):
+        url = requirement
+        name = os.path.basename(os.path.abspath(requirement))
+    else:
+        name, url = requirement, None
 
-    if PLATFORM == 'Windows':
-        src = os.path.normpath(src)
-        dest = os.path.normpath(dest)
-        if os.path.isdir(dest):
-            run('cmd.exe /C rmdir %s' % dest)
-        stdout, stderr = run('cmd.exe /C mklink /D %s %s' % (dest, src))
+    ref = None
+    if url:
+        match = re.search(r'@([^@#/]+)(?:#|$)', url.split('://', 1)[-1])
+        if match:
+            ref = match.group(1)
     else:
-        if os.path.isdir(dest):
-            os.remove(dest)
-        os.symlink(src, dest)
+        match = re.match(r'([A-Za-z0-9._-]+)\s*===?\s*([^,\s]+)$', name)
+        if match:
+            name, ref = match.groups()
+    name = re.match(r'\s*([A-Za-z0-9][A-Za-z0-9._]*)', name).group(1)
+    return normalize_name(name), url, ref
 
 
-def copy_scripts(dest):
-    '''Copies scripts from construct_setup/bin to dest'''
+def requirement_name(requirement):
+    '''Get the project name from a requirement string.'''
 
-    # Bat files
-    construct_bat = join_path(THIS_BIN, 'construct.bat')
-    cons_bat = join_path(dest, 'cons.bat')
-    log('%s -> %s', construct_bat, dest)
-    shutil.copy2(construct_bat, dest)
-    log('%s -> %s', cons_bat, dest)
-    shutil.copy2(construct_bat, cons_bat)
+    return parse_requirement(requirement)[0]
 
-    # Ps1 files
-    construct_ps1 = join_path(THIS_BIN, 'construct.ps1')
-    cons_ps1 = join_path(dest, 'cons.ps1')
-    log('%s -> %s', construct_ps1, dest)
-    shutil.copy2(construct_ps1, dest)
-    log('%s -> %s', construct_ps1, cons_ps1)
-    shutil.copy2(construct_ps1, cons_ps1)
 
-    # Bash files
-    construct_sh = join_path(THIS_BIN, 'construct.sh')
-    log('%s -> %s', construct_sh, dest)
-    shutil.copy2(construct_sh, dest)
+def wheel_name(wheel):
+    '''Get the project name from a wheel filename.'''
 
+    return normalize_name(os.path.basename(wheel).split('-')[0])
 
-def write_pth(site, lib, bin):
-    '''Creates a pth file pointing to custom python lib directory.'''
 
-    lib_path = os.path.relpath(lib, site).replace('\\', '/')
-    bin_path = os.path.relpath(bin, site).replace('\\', '/')
-    site_path = join_path(site, 'construct.pth')
-    log('Writing %s.', site_path)
-    set_indent('    ' * 2)
-    log(lib_path)
-    log(bin_path)
-    set_indent('    ')
-    with open(site_path, 'w') as f:
-        f.write('\n'.join([lib_path, bin_path]))
+def find_wheels(wheel_dir):
+    '''Sorted list of wheel files in wheel_dir.'''
 
+    if not os.path.isdir(wheel_dir):
+        return []
+    return sorted(
+        join_path(wheel_dir, f)
+        for f in os.listdir(wheel_dir)
+        if f.endswith('.whl')
+    )
 
-def update_profile(bash_profile_path, export_cmd, source_cmd, config_cmd=None):
-    '''Update bash profile on Linux and MacOS'''
-
-    touch(bash_profile_path)
-
-    with open(bash_profile_path, 'r') as f:
-        bash_profile = f.read()
-
-    changed = False
-    if export_cmd not in bash_profile:
-        bash_profile += '\n' + export_cmd + '\n'
-        changed = True
-    if source_cmd not in bash_profile:
-        bash_profile += source_cmd + '\n'
-        changed = True
-    if config_cmd:
-        match = re.search(r'export CONSTRUCT_CONFIG.*', bash_profile, re.M)
-        if not match:
-            bash_profile += export_cmd + '\n'
+
+def read_wheel_requires(wheel):
+    '''Read the Requires-Dist entries from a wheel's METADATA.'''
+
+    with zipfile.ZipFile(wheel) as zf:
+        for name in zf.namelist():
+            if name.endswith('.dist-info/METADATA'):
+                metadata = zf.read(name).decode('utf-8')
+                break
         else:
-            string = match.group(0)
-            bash_profile = bash_profile.replace(string, export_cmd)
-        changed = True
-    if changed:
-        debug('Creating backup profile %s.bak', bash_profile_path)
-        shutil.copy2(bash_profile_path, bash_profile_path + '.bak')
-        debug('Writing %s', bash_profile_path)
-        with open(bash_profile_path, 'w') as f:
-            f.write(bash_profile)
+            return []
+    return parse_requires(metadata)
 
 
-class Installer(object):
-    '''Construct Installer...
+def parse_requires(metadata):
+    '''Parse the Requires-Dist entries from the contents of a METADATA
+    file.'''
 
-    Arguments:
-        version (str): x.x.x version string
-        name (str): Optional name to use instead of version string
-        python (str): Path to python interpreter to use
-        where (str): Install directory(defaults: C:/Construct, /opt/construct)
-        config (str): Path to construct configuration file
-        local (str): If True install from current working directory
-        ignore_prompts (bool): Ignore install prompts if True
-    '''
-    def __init__(
-        self,
-        version,
-        name,
-        python,
-        where,
-        config,
-        local,
-        ignore_prompts=False
-    ):
-        self.version = version
-        self.name = name or version
-        self.python = python
-        self.where = os.path.abspath(where)
-        self.config = config if config is None else os.path.abspath(config)
-        self.pip_package = '.' if local else PIP_PACKAGE % version
-        self.ignore_prompts = ignore_prompts
-        self.install_path = join_path(self.where, self.name)
-        self.install_current = join_path(self.where, 'current')
-        self.install_lib = join_path(self.install_path, 'lib')
-        self.install_lib_bin = join_path(self.install_lib, 'bin')
-        self.install_bin = join_path(self.install_path, 'bin')
-        self.install_env = join_path(self.install_path, 'python')
+    requires = []
+    for line in metadata.splitlines():
+        if not line.strip():
+            break  # End of headers
+        if line.startswith('Requires-Dist:'):
+            requirement = line.split(':', 1)[1].strip()
+            if 'extra ==' in requirement:
+                continue
+            requires.append(requirement)
+    return requires
 
-        if PLATFORM == 'Windows':
-            self.install_py = join_path(
-                self.install_env,
-                'Scripts',
-                'python.exe',
-            )
-            self.install_site = join_path(
-                self.install_env,
-                'lib',
-                'site-packages',
-            )
-        else:
-            pyver = 'python' + get_python_version(python)
-            self.install_py = join_path(
-                self.install_env,
-                'bin',
-                'python',
-            )
-            self.install_site = join_path(
-                self.install_env,
-                'lib',
-                pyver,
-                'site-packages',
-            )
 
-    def run(self):
-        '''Run the installer including any platform specific install steps.'''
+def pip_wheel(python, requirement, wheel_dir, *args):
+    '''Build wheels for a requirement into wheel_dir.
 
-        log(
-            '\nInstalling Construct-%s to "%s".',
-            self.version,
-            self.install_path,
-        )
-        log('Using "%s".', self.python)
+    Unlike pip_install this never aborts, it returns a tuple containing
+    a success flag and the last lines of pip's output. Git requirements are
+    built from their mirror when the repository is mirrored.
+    '''
 
-        with step('Ensure install directories exist...'):
-            ensure_exists(self.where)
-            ensure_exists(self.install_path)
+    args = [
+        python, '-m', 'pip', 'wheel',
+        '--wheel-dir=%s' % escape(wheel_dir),
+    ] + list(args) + [escape(redirect_requirement(requirement))]
+    cmd = ' '.join(args)
+    debug('%s', cmd)
+    command = Command(cmd, stderr=STDOUT)
+    command.run()
+    return command.returncode == 0, command.stdout
 
-        with step('Create python virtualenv...'):
-            create_venv(self.python, self.install_env, self.install_py)
 
-        with step('Add pth file to virtualenv...'):
-            write_pth(self.install_site, self.install_lib, self.install_bin)
+def fetch_wheels(python, requirement, wheel_dir, cache=None, *args):
+    '''Get wheels for a requirement from the cache or build them.
 
-        with step('Install construct to virtualenv...'):
-            pip_install(
-                self.install_py,
-                '-I',  # Ignore installed
-                '-U',  # Force upgrade
-                self.pip_package,
-                '--target=%s' % self.install_lib
-            )
+    Returns the directory containing the wheels, this is a directory in the
+    cache when a WheelCache is provided and wheel_dir otherwise.
+    '''
 
-        with step('Move installed python console scripts...'):
-            move_dir(self.install_lib_bin, self.install_bin)
+    name = requirement_name(requirement)
+    if cache:
+        cached = cache.get(requirement)
+        if cached:
+            log('Using cached %s.', name)
+            return cached
 
-        with step('Install construct and cons shell scripts...'):
-            copy_scripts(self.where)
+    log('Building %s...', name)
+    success, output = pip_wheel(python, requirement, wheel_dir, *args)
+    if not success:
+        raise BuildError(requirement, output)
+    log('Built %s.', name)
 
-        with step('Update symlink %s...', self.install_current):
-            update_symlink(self.install_path, self.install_current)
+    if cache:
+        return cache.put(requirement, wheel_dir)
+    return wheel_dir
 
-        # Run platform specific install steps
-        {
-            'Windows': self.windows_steps,
-            'Mac': self.mac_steps,
-            'Linux': self.unix_steps,
-        }[PLATFORM]()
 
-        log('\nInstall complete!')
-        log('\nYou should now have access to the construct cli.\n')
-        log('    cons -h')
+def resolve_dependencies(python, package, wheel_dir, cache=None):
+    '''Build the construct_setup wheel for package and read its requirements.
 
-    def windows_steps(self):
-        '''Windows specific install steps.'''
+    Returns a tuple containing the path to the construct_setup wheel and
+    the list of requirements declared by setup.py's Dependencies.
+    '''
 
-        if is_elevated():
-            with step('Setting windows acls...'):
-                set_user_acls(self.install_path)
+    log('Resolving %s', package)
+    wheel_dir = fetch_wheels(python, package, wheel_dir, cache, '--no-deps')
 
-        # Modify system PATH to include construct install directory
-        with step('Adding %s to system PATH...', self.where):
-            system_path = _win_get_env('PATH')
-            if self.where not in system_path.split(';'):
-                if is_elevated():
-                    execute_after(
-                        'setx /M PATH "%s;%s"' % (self.where, system_path)
-                    )
-            execute_after('set "PATH=%s;%%PATH%%"' % self.where)
+    for wheel in find_wheels(wheel_dir):
+        if wheel_name(wheel) == 'construct_setup':
+            return wheel, read_wheel_requires(wheel)
+    raise BuildError(package, 'No construct_setup wheel in %s' % wheel_dir)
 
-        if self.config:
-            with step('Setting CONSTRUCT_CONFIG to %s...', self.config):
-                if is_elevated():
-                    execute_after(
-                        'setx /M CONSTRUCT_CONFIG "%s"' % self.config
-                    )
-                execute_after('set "CONSTRUCT_CONFIG=%s"' % self.config)
 
-    def mac_steps(self):
-        '''Mac specific install steps'''
+def build_wheels(python, requirements, wheelhouse, jobs, cache=None):
+    '''Build wheels for requirements concurrently.
 
-        self.unix_steps()
-        # TODO: Create Application
-        # TODO: Modify plist
+    Each requirement is built with its dependencies into its own directory
+    in wheelhouse so concurrent pip processes never share a wheel dir.
+    Requirements found in the WheelCache are not built at all.
 
-    def unix_steps(self):
-        '''Linux / Unix install steps'''
+    Returns a list of wheel directories in the same order as requirements,
+    and a list of BuildErrors for the requirements that failed.
+    '''
 
-        export_cmd = 'export PATH=%s:$PATH' % self.where
-        source_cmd = 'source %s/construct.sh' % self.where
-        config_cmd = None
-        if config:
-            config_cmd = 'export CONSTRUCT_CONFIG=%s' % self.config
+    def build(requirement):
+        wheel_dir = join_path(wheelhouse, requirement_name(requirement))
+        return fetch_wheels(python, requirement, wheel_dir, cache)
 
-        if is_elevated():
-            bash_profile_path = '/etc/profile'
+    wheel_dirs, failures = [], []
+    for result, exc in parallel_map(build, requirements, jobs):
+        if exc:
+            failures.append(exc)
         else:
-            bash_profile_path = os.path.expanduser('~/.profile')
+            wheel_dirs.append(result)
+    return wheel_dirs, failures
 
-        with step('Add construct to bash profile...'):
-            update_profile(
-                bash_profile_path,
-                export_cmd,
-                source_cmd,
-                config_cmd,
+
+def collect_wheels(wheel_dirs):
+    '''Collect one wheel per project from a list of wheel directories.
+
+    Directories are searched in order, so the wheels of the top-level
+    requirements take precedence over wheels built as dependencies.
+    '''
+
+    return select_wheels([find_wheels(wheel_dir) for wheel_dir in wheel_dirs])
+
+
+def select_wheels(wheel_lists):
+    '''Select one wheel per project from a list of lists of wheels.
+
+    Lists are searched in order like collect_wheels. Wheels may be paths or
+    plain filenames.
+    '''
+
+    wheels = {}
+    for wheel_list in wheel_lists:
+        for wheel in wheel_list:
+            name = wheel_name(wheel)
+            if name not in wheels:
+                wheels[name] = wheel
+            elif (
+                os.path.basename(wheels[name]) != os.path.basename(wheel)
+            ):
+                warning(
+                    'Ignoring %s, using %s.',
+                    os.path.basename(wheel),
+                    os.path.basename(wheels[name]),
+                )
+    return [wheels[name] for name in sorted(wheels)]
+
+
+def is_pure_wheel(wheel):
+    '''Check if a wheel is pure python and platform independent.'''
+
+    tags = os.path.basename(wheel)[:-len('.whl')].split('-')[-2:]
+    return tags == ['none', 'any']
+
+
+def report_build_failures(failures, tail=20):
+    '''Log the tail of pip's output for each failed build.'''
+
+    for failure in failures:
+        error('Failed to build %s', failure.requirement)
+        lines = failure.output.rstrip().splitlines()[-tail:]
+        for line in lines:
+            log('    %s', line)
+
+
+# Wheel Cache
+class WheelCache(object):
+    '''Persistent cache of built wheels shared between installs.
+
+    Entries are keyed on (package, ref, python tag) where ref is the git ref
+    or version a requirement is pinned to and the python tag identifies the
+    interpreter version and platform. Each entry holds all of the wheels pip
+    built for a requirement including its dependencies.
+
+    Unpinned requirements like fsfs are cached as "latest" and expire after
+    CACHE_LATEST_TTL seconds. Requirements pointing to local files or urls
+    without a ref are never cached.
+
+    Arguments:
+        root (str): Cache directory
+        python_tag (str): Tag identifying the target interpreter
+        max_size (int): Maximum size of the cache in megabytes
+    '''
+
+    marker = '.last_used'
+
+    def __init__(self, root, python_tag, max_size=DEFAULT_CACHE_SIZE):
+        self.root = root
+        self.python_tag = python_tag
+        self.max_size = max_size * 1024 * 1024
+
+    def key(self, requirement):
+        '''Get the (name, ref) key for a requirement or None.'''
+
+        name, url, ref = parse_requirement(requirement)
+        if ref is None:
+            if url:
+                return None
+            ref = 'latest'
+        return name, re.sub(r'[^A-Za-z0-9._-]', '_', ref)
+
+    def entry_path(self, key):
+        return join_path(self.root, key[0], key[1], self.python_tag)
+
+    def get(self, requirement):
+        '''Get the entry directory for a requirement and mark it as used.'''
+
+        key = self.key(requirement)
+        if not key:
+            return
+
+        path = self.entry_path(key)
+        marker = join_path(path, self.marker)
+        if not os.path.isfile(marker) or not find_wheels(path):
+            return
+
+        if key[1] == 'latest':
+            age = time.time() - os.path.getmtime(path)
+            if age > CACHE_LATEST_TTL:
+                debug('Cache entry expired %s', path)
+                shutil.rmtree(path, ignore_errors=True)
+                return
+
+        touch(marker)
+        return path
+
+    def put(self, requirement, wheel_dir):
+        '''Move a directory of wheels into the cache.
+
+        Returns the entry directory, or wheel_dir if the requirement can not
+        be cached.
+        '''
+
+        key = self.key(requirement)
+        if not key:
+            return wheel_dir
+
+        path = self.entry_path(key)
+        parent = os.path.dirname(path)
+        if not os.path.isdir(parent):
+            try:
+                os.makedirs(parent)
+            except OSError:
+                pass  # Created by a concurrent install
+
+        # Copy into a staging directory next to the entry then rename it
+        # so that concurrent installs never see a partial entry.
+        staging = tempfile.mkdtemp(prefix='.tmp_', dir=parent)
+        for wheel in find_wheels(wheel_dir):
+            shutil.copy2(wheel, staging)
+        touch(join_path(staging, self.marker))
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.rename(staging, path)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+        return path
+
+    def entries(self):
+        '''List of (path, size, last_used) tuples for all cache entries.'''
+
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+
+        for root, subdirs, files in os.walk(self.root):
+            if self.marker not in files:
+                continue
+            subdirs[:] = []
+            size = sum(
+                os.path.getsize(join_path(root, f))
+                for f in files
+            )
+            last_used = os.path.getmtime(join_path(root, self.marker))
+            entries.append((root, size, last_used))
+        return entries
+
+    def evict(self):
+        '''Remove least recently used entries until the cache fits max_size.
+
+        Returns the number of bytes removed.
+        '''
+
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(entry[1] for entry in entries)
+        removed = 0
+        while entries and total > self.max_size:
+            path, size, _ = entries.pop(0)
+            debug('Evicting %s', path)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed += size
+        if removed:
+            log('Evicted %d MB from wheel cache.', removed // (1024 * 1024))
+        return removed
+
+
+# Offline Bundles
+BUNDLE_MANIFEST = 'bundle.json'
+BUNDLE_FOLDERS = ('wheels', 'pip', 'bin')
+
+
+def write_bundle(path, manifest, folders):
+    '''Write a gzipped tar bundle of wheels and scripts for offline installs.
+
+    Arguments:
+        path (str): Path to write the bundle to
+        manifest (dict): Data to store in the bundle's manifest
+        folders (dict): Maps a folder in BUNDLE_FOLDERS to a list of files
+
+    The manifest is written first so that it can be read without reading
+    through the rest of the archive.
+    '''
+
+    manifest = dict(manifest)
+    for folder, files in folders.items():
+        manifest[folder] = [os.path.basename(f) for f in files]
+    data = json.dumps(manifest, indent=4, sort_keys=True).encode('utf-8')
+
+    tmp_path = path + '.tmp'
+    with tarfile.open(tmp_path, 'w:gz') as bundle:
+        info = tarfile.TarInfo(BUNDLE_MANIFEST)
+        info.size = len(data)
+        info.mtime = time.time()
+        bundle.addfile(info, io.BytesIO(data))
+        for folder in BUNDLE_FOLDERS:
+            for f in folders.get(folder, []):
+                arcname = folder + '/' + os.path.basename(f)
+                log('Adding %s', arcname)
+                bundle.add(f, arcname)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+def read_bundle_manifest(path):
+    '''Read the manifest of a bundle created by write_bundle.'''
+
+    with tarfile.open(path, 'r|*') as bundle:
+        for member in bundle:
+            if member.name == BUNDLE_MANIFEST:
+                data = bundle.extractfile(member).read()
+                return json.loads(data.decode('utf-8'))
+            break
+    raise ValueError('%s is not a construct bundle.' % path)
+
+
+def unpack_bundle(path, dest):
+    '''Stream the wheels and scripts in a bundle to dest.
+
+    The bundle is read sequentially so it can be piped from a network share
+    without seeking. Returns the bundle's manifest.
+    '''
+
+    manifest = None
+    with tarfile.open(path, 'r|*') as bundle:
+        for member in bundle:
+            if member.name == BUNDLE_MANIFEST:
+                data = bundle.extractfile(member).read()
+                manifest = json.loads(data.decode('utf-8'))
+                continue
+
+            folder, _, name = member.name.partition('/')
+            if not member.isfile() or folder not in BUNDLE_FOLDERS:
+                continue
+            if not name or '/' in name or name.startswith('.'):
+                continue
+
+            debug('Unpacking %s', member.name)
+            dest_path = join_path(dest, folder, name)
+            if not os.path.isdir(os.path.dirname(dest_path)):
+                os.makedirs(os.path.dirname(dest_path))
+            src = bundle.extractfile(member)
+            with open(dest_path, 'wb') as f:
+                shutil.copyfileobj(src, f)
+            os.chmod(dest_path, member.mode)
+
+    if manifest is None:
+        raise ValueError('%s is not a construct bundle.' % path)
+    return manifest
+
+
+# Lockfiles
+LOCKFILE_VERSION = 1
+LOCKED_FETCH_JOBS = 8
+
+
+def split_git_url(url):
+    '''Split a pip git url into a tuple of (repository url, ref).'''
+
+    url = url.split('#', 1)[0]
+    if url.startswith('git+'):
+        url = url[len('git+'):]
+    scheme, _, path = url.partition('://')
+    ref = None
+    if '@' in path.rsplit('/', 1)[-1]:
+        path, ref = path.rsplit('@', 1)
+    return scheme + '://' + path, ref
+
+
+def git_commit(url, ref):
+    '''Resolve a ref of a remote git repository to a commit sha.
+
+    Raises BuildError if the ref does not exist.
+    '''
+
+    refs = [ref, ref + '^{}']
+    proc = Popen(
+        ['git', 'ls-remote', redirect_git_url(url)] + refs,
+        stdout=PIPE,
+        stderr=STDOUT,
+    )
+    output, _ = proc.communicate()
+    if not isinstance(output, str):
+        output = output.decode('utf-8', 'replace')
+    if proc.returncode != 0:
+        raise BuildError(url, output)
+
+    commits = {}
+    for line in output.splitlines():
+        if '\t' in line:
+            sha, name = line.split('\t', 1)
+            commits[name.endswith('^{}')] = sha
+    commit = commits.get(True) or commits.get(False)
+    if not commit and re.match(r'^[0-9a-f]{40}$', ref):
+        commit = ref
+    if not commit:
+        raise BuildError(url, 'No ref named %s.' % ref)
+    return commit
+
+
+def lock_package(python, wheel, sources):
+    '''Get the lockfile entry for a wheel.
+
+    Packages found in sources, a dict mapping names to urls, are pinned to
+    the commit their git ref points to or to their url. Other packages are
+    pinned to their version. The hash of the artifact pip downloads for
+    packages that are not in git is recorded too.
+    '''
+
+    name = wheel_name(wheel)
+    version = os.path.basename(wheel).split('-')[1]
+    package = {
+        'name': name,
+        'version': version,
+        'wheel': os.path.basename(wheel),
+        'sha256': file_digest(wheel),
+    }
+    url = sources.get(name)
+    if url and url.startswith('git+'):
+        repo, ref = split_git_url(url)
+        commit = git_commit(repo, ref or 'HEAD')
+        package['commit'] = commit
+        package['requirement'] = '%s @ git+%s@%s#egg=%s' % (
+            name, repo, commit, name,
+        )
+        return package
+
+    if url:
+        package['requirement'] = '%s @ %s' % (name, url)
+        if url.startswith('file:') and os.path.isdir(url[len('file://'):]):
+            return package  # Pip can not check the hash of a directory
+    else:
+        package['requirement'] = '%s==%s' % (name, version)
+    tmp_dir = tempfile.mkdtemp(prefix='construct_lock_')
+    try:
+        cmd = ' '.join([
+            python, '-m', 'pip', 'download', '--no-deps',
+            '--dest=%s' % escape(tmp_dir),
+            escape(package['requirement']),
+        ])
+        if not run(cmd, abort_on_fail=False):
+            raise BuildError(package['requirement'], 'Failed: %s' % cmd)
+        artifacts = os.listdir(tmp_dir)
+        if artifacts:
+            package['artifact'] = artifacts[0]
+            package['artifact_sha256'] = file_digest(
+                join_path(tmp_dir, artifacts[0])
+            )
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return package
+
+
+def read_lockfile(path):
+    '''Read a lockfile written by Installer.export_lock.'''
+
+    with open(path, 'r') as f:
+        lock = json.load(f)
+    if lock.get('lockfile_version') != LOCKFILE_VERSION:
+        raise ValueError('%s is not a supported lockfile.' % path)
+    return lock
+
+
+def fetch_locked(python, package, wheel_dir, cache=None):
+    '''Fetch the wheel of a locked package.
+
+    The wheel cache is used when it holds a wheel with the locked hash.
+    Otherwise git packages are built from the locked commit and other
+    packages from an artifact matching the locked artifact hash.
+
+    Returns a tuple of the path to the wheel and True if its hash matches
+    the lockfile.
+    '''
+
+    requirement = package['requirement']
+    if cache:
+        cached = cache.get(requirement)
+        wheel = cached and join_path(cached, package['wheel'])
+        if wheel and os.path.isfile(wheel):
+            if file_digest(wheel) == package['sha256']:
+                log('Using cached %s.', package['name'])
+                return wheel, True
+
+    log('Fetching %s...', package['name'])
+    if not os.path.isdir(wheel_dir):
+        os.makedirs(wheel_dir)
+    if package.get('artifact_sha256'):
+        # Pip checks the hash of what it downloads in hash checking mode
+        requirements = join_path(wheel_dir, 'requirements.txt')
+        with open(requirements, 'w') as f:
+            f.write('%s --hash=sha256:%s\n' % (
+                redirect_requirement(requirement),
+                package['artifact_sha256'],
+            ))
+        success, output = pip_wheel(
+            python,
+            requirements,
+            wheel_dir,
+            '--no-deps',
+            '--require-hashes',
+            '-r',
+        )
+        os.remove(requirements)
+    else:
+        success, output = pip_wheel(python, requirement, wheel_dir,
+                                    '--no-deps')
+    if not success:
+        raise BuildError(requirement, output)
+
+    if cache:
+        wheel_dir = cache.put(requirement, wheel_dir)
+    wheel = join_path(wheel_dir, package['wheel'])
+    if not os.path.isfile(wheel):
+        raise BuildError(requirement, 'Expected %s.' % package['wheel'])
+    return wheel, file_digest(wheel) == package['sha256']
+
+
+# Object Store
+def file_digest(path, chunk_size=1024 * 1024):
+    '''Get the sha256 hexdigest of a file's contents.'''
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def replace_file(src, dest):
+    '''Rename src over dest.'''
+
+    if hasattr(os, 'replace'):
+        return os.replace(src, dest)
+    if PLATFORM == 'Windows' and os.path.exists(dest):
+        os.remove(dest)
+    os.rename(src, dest)
+
+
+def clone_file(src, dest):
+    '''Create dest as a reflink of src on filesystems that support it.'''
+
+    import fcntl
+    FICLONE = 0x40049409
+    fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+    try:
+        with open(src, 'rb') as src_file:
+            fcntl.ioctl(fd, FICLONE, src_file.fileno())
+    except (IOError, OSError):
+        os.close(fd)
+        os.remove(dest)
+        raise
+    os.close(fd)
+    shutil.copymode(src, dest)
+
+
+def link_file(src, dest):
+    '''Hardlink src to dest falling back to a reflink.
+
+    Raises OSError when dest exists or when neither is supported between
+    src and dest.
+    '''
+
+    link = getattr(os, 'link', None)
+    if link:
+        try:
+            return link(src, dest)
+        except OSError as e:
+            if e.errno == errno.EEXIST or PLATFORM != 'Linux':
+                raise
+    try:
+        clone_file(src, dest)
+    except ImportError as e:
+        raise OSError(str(e))
+
+
+class ObjectStore(object):
+    '''Content addressed store of files shared by installed versions.
+
+    Files are stored once in objects/ keyed on the sha256 of their content
+    and hardlinked into each version's lib directory. An object that is no
+    longer linked into any version has a link count of one and is removed
+    by gc. Objects that had to be reflinked instead are marked with a
+    .clone file, their link count says nothing about their use so gc keeps
+    them.
+
+    Arguments:
+        root (str): Store directory (default: <where>/.store)
+    '''
+
+    def __init__(self, root):
+        self.root = root
+        self.objects = join_path(root, 'objects')
+
+    clone_suffix = '.clone'
+
+    def object_path(self, digest):
+        return join_path(self.objects, digest[:2], digest[2:])
+
+    def add_file(self, path):
+        '''Store a file and replace it with a link to the stored object.
+
+        Returns True if a new object was added to the store.
+        '''
+
+        digest = file_digest(path)
+        if os.access(path, os.X_OK):
+            digest += 'x'  # Links share modes, keep executables apart
+        obj = self.object_path(digest)
+
+        if not os.path.exists(obj):
+            folder = os.path.dirname(obj)
+            if not os.path.isdir(folder):
+                try:
+                    os.makedirs(folder)
+                except OSError:
+                    pass  # Created by another thread
+            try:
+                link_file(path, obj)
+                if not os.path.samefile(path, obj):
+                    # Reflinked, gc can not tell when it is unused
+                    open(obj + self.clone_suffix, 'w').close()
+                return True
+            except OSError:
+                if not os.path.exists(obj):
+                    raise
+                # Added by another thread or install, link to it instead
+
+        if os.path.samefile(path, obj):
+            return False
+        tmp_path = path + '.construct_link'
+        link_file(obj, tmp_path)
+        replace_file(tmp_path, path)
+        return False
+
+    def add_tree(self, folder, jobs=1):
+        '''Store all files in folder replacing them with links.
+
+        Returns a tuple containing the number of files, the number of new
+        objects and the number of bytes shared with existing objects.
+        '''
+
+        paths = []
+        for root, subdirs, files in os.walk(folder):
+            for f in files:
+                path = join_path(root, f)
+                if not os.path.islink(path):
+                    paths.append(path)
+
+        new_objects = shared = 0
+        for path, (added, exc) in zip(
+            paths,
+            parallel_map(self.add_file, paths, jobs)
+        ):
+            if exc:
+                raise exc
+            if added:
+                new_objects += 1
+            else:
+                shared += os.path.getsize(path)
+        return len(paths), new_objects, shared
+
+    def gc(self):
+        '''Remove objects no longer linked into any version.
+
+        Returns a tuple containing the number of objects and bytes removed.
+        '''
+
+        removed = size = 0
+        if not os.path.isdir(self.objects):
+            return removed, size
+
+        for root, subdirs, files in os.walk(self.objects, topdown=False):
+            for f in files:
+                path = join_path(root, f)
+                if f.endswith(self.clone_suffix) or os.path.exists(
+                    path + self.clone_suffix
+                ):
+                    continue  # Reflinked, never collected
+                stat = os.stat(path)
+                if stat.st_nlink > 1:
+                    continue
+                debug('Removing %s', path)
+                os.remove(path)
+                removed += 1
+                size += stat.st_size
+            if root != self.objects and not os.listdir(root):
+                os.rmdir(root)
+        return removed, size
+
+
+# Git Mirrors
+GIT_FETCH_JOBS = 8
+GIT_MIRRORS_DIR = '.cache/git'  # Relative to where
+SETUP_GIT_PATTERN = re.compile(
+    r"requires\.git\(\s*['\"]([^'\"]+)['\"]\s*,\s*['\"]([^'\"]+)['\"]"
+)
+GITHUB_URL = 'https://github.com/'
+_mirror_urls = {}  # Repository urls mapped to the file urls of their mirrors
+
+
+def read_sources(path):
+    '''Read a JSON file mapping url prefixes to the prefixes that replace
+    them, like {"https://github.com/construct-org/": "https://git.local/"}.
+    '''
+
+    with open(path, 'r') as f:
+        sources = json.load(f)
+    if not isinstance(sources, dict):
+        raise ValueError('%s must contain a JSON object.' % path)
+    return sources
+
+
+def map_url(url, sources):
+    '''Replace the longest prefix of url found in sources.'''
+
+    for prefix in sorted(sources, key=len, reverse=True):
+        if url.startswith(prefix):
+            return sources[prefix] + url[len(prefix):]
+    return url
+
+
+def git_url_env(sources):
+    '''Get environment variables that make every git command rewrite urls
+    using sources.
+
+    This sets url.<replacement>.insteadOf through GIT_CONFIG_COUNT, so the
+    git commands pip runs for transitive dependencies are redirected too.
+    Requires git 2.31 or later.
+    '''
+
+    env = {'GIT_CONFIG_COUNT': str(len(sources))}
+    for i, prefix in enumerate(sorted(sources)):
+        env['GIT_CONFIG_KEY_%d' % i] = 'url.%s.insteadOf' % sources[prefix]
+        env['GIT_CONFIG_VALUE_%d' % i] = prefix
+    return env
+
+
+def redirect_git_url(url):
+    '''Get the url of the mirror of a repository url, or url itself when it
+    is not mirrored.'''
+
+    return _mirror_urls.get(url, url)
+
+
+def redirect_requirement(requirement):
+    '''Point the git url of a requirement at the mirror of its repository.
+
+    Only the exact repository url is replaced, a url that merely starts with
+    a mirrored url, like the url of another repository whose name extends
+    it, is left alone.
+    '''
+
+    for url, mirror in _mirror_urls.items():
+        prefix = 'git+' + url
+        index = requirement.find(prefix)
+        end = index + len(prefix)
+        if index != -1 and requirement[end:end + 1] in ('', '@', '#', ' '):
+            return requirement[:index] + 'git+' + mirror + requirement[end:]
+    return requirement
+
+
+def path_to_url(path):
+    '''Get a file url for an absolute path.
+
+    The url names localhost as its host, pip rejects git+file urls without
+    a host in requirements.
+    '''
+
+    path = path.replace('\\', '/')
+    if not path.startswith('/'):
+        path = '/' + path  # Windows drive
+    return 'file://localhost' + path
+
+
+def read_setup_git_urls(setup_py):
+    '''Get the urls of the git repositories required by the contents of
+    construct_setup's setup.py.'''
+
+    return [
+        GITHUB_URL + org + '/' + package
+        for org, package in SETUP_GIT_PATTERN.findall(setup_py)
+    ]
+
+
+class GitMirrors(object):
+    '''Bare mirrors of git repositories.
+
+    Each repository is cloned once with git clone --mirror and refreshed
+    with git fetch afterwards, so only new objects are downloaded. Upstream
+    urls are mapped through sources first. Mirrors of repositories on the
+    same ssh host share one connection.
+
+    Arguments:
+        root (str): Mirrors directory (default: <where>/.cache/git)
+        sources (dict): Url prefixes mapped to the prefixes that replace them
+    '''
+
+    def __init__(self, root, sources=None):
+        self.root = root
+        self.sources = sources or {}
+        self.urls = set()
+
+    def path(self, url):
+        '''Get the mirror path of a repository url.'''
+
+        _, _, path = url.partition('://')
+        return join_path(self.root, path.rstrip('/'))
+
+    def env(self):
+        env = os.environ.copy()
+        env['GIT_TERMINAL_PROMPT'] = '0'
+        if PLATFORM != 'Windows' and 'GIT_SSH_COMMAND' not in env:
+            control_path = join_path(tempfile.gettempdir(), 'construct-%C')
+            env['GIT_SSH_COMMAND'] = (
+                'ssh -o ControlMaster=auto -o ControlPersist=60 '
+                '-o ControlPath=%s' % control_path
+            )
+        return env
+
+    def update(self, url):
+        '''Clone or fetch the mirror of a repository url.
+
+        A mirror that fails to fetch is used as is. Raises BuildError if a
+        mirror could not be created.
+        '''
+
+        path = self.path(url)
+        upstream = map_url(url, self.sources)
+        config = ['-c', 'protocol.version=2']
+        if os.path.isdir(path):
+            cmd = ['git'] + config + [
+                '--git-dir', path,
+                'fetch', '--prune', '--quiet', upstream, '+refs/*:refs/*',
+            ]
+        else:
+            parent = os.path.dirname(path)
+            if not os.path.isdir(parent):
+                try:
+                    os.makedirs(parent)
+                except OSError:
+                    pass  # Created by another thread
+            tmp_path = '%s.tmp-%d' % (path, os.getpid())
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            cmd = ['git'] + config + [
+                'clone', '--mirror', '--quiet', upstream, tmp_path,
+            ]
+
+        debug('%s', ' '.join(cmd))
+        command = Command(cmd, stderr=STDOUT, env=self.env())
+        command.run()
+        if command.returncode != 0:
+            if os.path.isdir(path):
+                warning('Failed to fetch %s, using mirror as is.', upstream)
+                return path
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise BuildError(upstream, command.stdout)
+        if not os.path.isdir(path):
+            os.rename(tmp_path, path)
+        return path
+
+    def update_all(self, urls, jobs=GIT_FETCH_JOBS):
+        '''Update the mirrors of urls concurrently.
+
+        Raises the first BuildError after reporting all of them.
+        '''
+
+        urls = sorted(set(urls))
+        failures = []
+        for url, (_, exc) in zip(urls, parallel_map(self.update, urls, jobs)):
+            if exc:
+                failures.append(exc)
+            else:
+                self.urls.add(url)
+        if failures:
+            report_build_failures(
+                [exc for exc in failures if isinstance(exc, BuildError)]
+            )
+            raise failures[0]
+
+    def show(self, url, ref, path):
+        '''Get the contents of a file at a ref of a mirrored repository.'''
+
+        return check_output(
+            ['git', '--git-dir', self.path(url), 'show', '%s:%s' % (ref, path)]
+        ).decode('utf-8')
+
+    def url_map(self):
+        '''Get a dict mapping the url of each updated mirror to the file url
+        of the mirror.
+
+        Each repository gets its own entry, see redirect_requirement.
+        '''
+
+        return dict((url, path_to_url(self.path(url))) for url in self.urls)
+
+
+# Install Manifest
+INSTALL_MANIFEST = 'install.json'
+INSTALL_REPORT = 'install_report.json'
+INSTALL_TRACE = 'install_trace.json'
+INSTALL_LOG = 'install_log.jsonl'
+STAGING_DIR = '.staging'
+HASH_JOBS = 8  # Worker threads used to hash an install's files
+
+
+def read_manifest(install_path):
+    '''Read the manifest written by a previous install or return None.'''
+
+    path = join_path(install_path, INSTALL_MANIFEST)
+    if not os.path.isfile(path):
+        return
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(install_path, manifest):
+    '''Write an install manifest to install_path.'''
+
+    path = join_path(install_path, INSTALL_MANIFEST)
+    debug('Writing %s', path)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    replace_file(path + '.tmp', path)
+
+
+def normalize_json(data):
+    '''Convert data to the form it is read back in from a JSON file.'''
+
+    return json.loads(json.dumps(data))
+
+
+def python_fingerprint(python):
+    '''Identify a python interpreter by its version, platform and the size
+    and modified time of its executable.'''
+
+    probe = probe_python(python)
+    stat = os.stat(probe['executable'])
+    return {
+        'executable': probe['executable'],
+        'version_info': probe['version_info'],
+        'platform': probe['platform'],
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+    }
+
+
+def get_dist_pins(lib):
+    '''Get a dict mapping each distribution installed to lib to its version.
+    '''
+
+    pins = {}
+    for folder in os.listdir(lib):
+        if folder.endswith(('.dist-info', '.egg-info')):
+            name, _, version = folder.rsplit('.', 1)[0].partition('-')
+            pins[normalize_name(name)] = version
+    return pins
+
+
+def get_tree_files(path, names):
+    '''List the files in the files and folders names of path.
+
+    Paths are relative to path. Bytecode is skipped since python may write it
+    when the install is used.
+    '''
+
+    files = []
+    for name in names:
+        root = os.path.join(path, name)
+        if os.path.isfile(root):
+            files.append(name)
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if d != '__pycache__']
+            rel = os.path.relpath(dirpath, path).replace('\\', '/')
+            files.extend(
+                rel + '/' + f for f in filenames if not f.endswith('.pyc')
+            )
+    return sorted(files)
+
+
+def tree_digest(path, files):
+    '''Get a digest of the size and modified time of files in path.
+
+    This only stats each file so it is cheap to compute, it changes whenever a
+    file is added, removed or written to.
+    '''
+
+    sha = hashlib.sha256()
+    for name in files:
+        stat = os.lstat(os.path.join(path, name))
+        line = '%s\0%d\0%.6f\n' % (name, stat.st_size, stat.st_mtime)
+        sha.update(line.encode('utf-8'))
+    return sha.hexdigest()
+
+
+def hash_tree(path, files, jobs):
+    '''Hash the contents of files in path using jobs worker threads.
+
+    Returns a dict mapping each file to its sha256 hexdigest, or None if the
+    file could not be read.
+    '''
+
+    results = parallel_map(
+        lambda name: file_digest(os.path.join(path, name)),
+        files,
+        jobs,
+    )
+    return dict((name, digest) for name, (digest, _) in zip(files, results))
+
+
+def diff_tree(expected, actual):
+    '''Compare two dicts returned by hash_tree.
+
+    Returns a sorted list of (name, status) tuples where status is one of
+    added, removed or changed.
+    '''
+
+    diff = []
+    for name in set(expected) | set(actual):
+        if name not in actual:
+            diff.append((name, 'removed'))
+        elif name not in expected:
+            diff.append((name, 'added'))
+        elif actual[name] is None or actual[name] != expected[name]:
+            diff.append((name, 'changed'))
+    return sorted(diff)
+
+
+SCRIPT_RECORD_PREFIX = '../../bin/'
+
+
+def get_installed_files(lib, wheel):
+    '''Get the files pip installed into lib from a wheel.
+
+    Paths are relative to lib and read from the installed RECORD.
+    '''
+
+    with zipfile.ZipFile(wheel) as zf:
+        for name in zf.namelist():
+            if name.endswith('.dist-info/RECORD'):
+                record = join_path(lib, name)
+                break
+        else:
+            return []
+
+    with open(record, 'r') as f:
+        return sorted(row[0] for row in csv.reader(f) if row)
+
+
+def copy_installed_files(files, src_lib, src_bin, dest_lib, link, jobs=1):
+    '''Copy the files of an installed distribution to another lib dir.
+
+    Console scripts are recorded relative to lib as ../../bin/<name>; they
+    are copied into dest_lib/bin, looking them up in src_bin when they have
+    already been moved out of src_lib, and their shebangs are rewritten to
+    point at the new version. When link is True files are hardlinked
+    instead of copied.
+    '''
+
+    def copy(path):
+        src = join_path(src_lib, path)
+        if path.startswith('bin/') and not os.path.exists(src):
+            src = join_path(src_bin, path[len('bin/'):])
+        dest = join_path(dest_lib, path)
+        if not os.path.isdir(os.path.dirname(dest)):
+            try:
+                os.makedirs(os.path.dirname(dest))
+            except OSError:
+                pass  # Created by another thread
+        if os.path.exists(dest):
+            os.remove(dest)
+        if link:
+            try:
+                return link_file(src, dest)
+            except OSError:
+                pass
+        shutil.copy2(src, dest)
+
+    paths = []
+    for path in files:
+        if path.startswith(SCRIPT_RECORD_PREFIX):
+            path = 'bin/' + path[len(SCRIPT_RECORD_PREFIX):]
+        elif path.startswith('..'):
+            continue
+        paths.append(path)
+    for _, exc in parallel_map(copy, paths, jobs):
+        if exc:
+            raise exc
+
+    if any(path.startswith('bin/') for path in paths):
+        fix_paths(
+            dest_lib,
+            os.path.dirname(src_lib),
+            os.path.dirname(dest_lib),
+            script_dirs=('bin',),
+        )
+
+
+def has_scripts(files):
+    '''Check if the RECORD files of a distribution include console
+    scripts.'''
+
+    return any(path.startswith('../') for path in files)
+
+
+def remove_installed_files(files, lib):
+    '''Remove the files of an installed distribution from lib.'''
+
+    for path in files:
+        path = join_path(lib, path)
+        if not path.startswith(lib) or not os.path.isfile(path):
+            continue
+        os.remove(path)
+        folder = os.path.dirname(path)
+        while folder != lib and not os.listdir(folder):
+            os.rmdir(folder)
+            folder = os.path.dirname(folder)
+
+
+# Checkpoints
+INSTALL_CHECKPOINTS = '.checkpoints.json'
+
+
+class Checkpoints(object):
+    '''Records which steps of an unfinished install completed so a rerun can
+    resume at the step that failed.
+
+    Each step is recorded with a hash of its inputs and of the step before
+    it, so when a step's inputs change it and every step after it run again.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.completed = {}
+        self.previous = ''
+        self.current = None
+
+    def load(self):
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as f:
+                self.completed = json.load(f)
+
+    def save(self):
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.completed, f, indent=4, sort_keys=True)
+        replace_file(self.path + '.tmp', self.path)
+
+    def clear(self):
+        self.completed = {}
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def begin(self, name, inputs):
+        '''Start a step, returns True if it already completed.
+
+        Pass None as inputs for steps that should always run.
+        '''
+
+        if inputs is None:
+            digest = binascii.hexlify(os.urandom(16)).decode('ascii')
+        else:
+            data = json.dumps([self.previous, name, inputs], sort_keys=True)
+            digest = hashlib.sha256(data.encode('utf-8')).hexdigest()
+        self.previous = digest
+        self.current = name
+        return self.completed.get(name) == digest
+
+    def end(self):
+        '''Record the current step as completed.'''
+
+        self.completed[self.current] = self.previous
+        self.save()
+
+
+# Smoke Tests
+SMOKE_CLI = 'construct'
+SMOKE_CLI_ARGS = ['-h']
+SMOKE_CLI_SCRIPT = '''
+import importlib, sys
+sys.argv = %r
+obj = importlib.import_module(%r)
+for attr in %r:
+    obj = getattr(obj, attr)
+sys.exit(obj())
+'''
+
+
+def find_dist_info(lib, name):
+    '''Find the dist-info folder of a distribution installed to lib.'''
+
+    name = normalize_name(name)
+    for folder in os.listdir(lib):
+        if not folder.endswith('.dist-info'):
+            continue
+        if normalize_name(folder.split('-')[0]) == name:
+            return join_path(lib, folder)
+
+
+def get_dependency_modules(lib, dist='construct_setup'):
+    '''Get the top level modules of each dependency of dist installed to lib.
+
+    Returns a list of (name, modules) tuples in the order they are required.
+    '''
+
+    dist_info = find_dist_info(lib, dist)
+    if not dist_info:
+        raise RuntimeError('%s is not installed to %s.' % (dist, lib))
+    with io.open(join_path(dist_info, 'METADATA'), encoding='utf-8') as f:
+        requires = parse_requires(f.read())
+
+    dependencies = []
+    for requirement in requires:
+        name = requirement_name(requirement)
+        modules = [name]
+        dist_info = find_dist_info(lib, name)
+        top_level = dist_info and join_path(dist_info, 'top_level.txt')
+        if top_level and os.path.isfile(top_level):
+            with open(top_level, 'r') as f:
+                modules = [line.strip() for line in f if line.strip()]
+        dependencies.append((name, modules))
+    return dependencies
+
+
+def run_timed(cmd, env=None):
+    '''Run a command and return a tuple of (returncode, output, seconds).
+
+    Output is the last lines of the command's combined stdout and stderr.
+    '''
+
+    debug('%s', ' '.join(cmd))
+    start = time.time()
+    command = Command(cmd, stderr=STDOUT, env=env)
+    command.run()
+    return command.returncode, command.stdout, time.time() - start
+
+
+# Zipped Lib
+LIB_ZIP = 'lib.zip'
+INSTALL_TREE = ('lib', 'bin', LIB_ZIP)  # Files hashed by the install manifest
+
+
+def is_zip_safe(path):
+    '''Check if a top level module or package in lib can be imported from a
+    zip archive.
+
+    Packages containing anything besides python source and bytecode, like
+    native extensions or data files, are not zip safe.
+    '''
+
+    if os.path.isfile(path):
+        return path.endswith('.py')
+    if not os.path.isfile(join_path(path, '__init__.py')):
+        return False  # Namespace packages and other folders
+    for root, subdirs, files in os.walk(path):
+        for f in files:
+            if not f.endswith(('.py', '.pyc')):
+                return False
+    return True
+
+
+def zip_packages(lib, zip_path):
+    '''Move the zip safe modules and packages in lib to a zip archive.
+
+    Bytecode compiled to __pycache__ is stored next to its source where
+    zipimport looks for it. Zipped packages are moved aside to
+    <zip_path>.pending before the archive is moved in place and removed
+    after, a run interrupted in between puts them back in lib so they are
+    zipped again. Returns the names of the zipped modules and packages.
+    '''
+
+    def bytecode(src_root, f):
+        cache = join_path(src_root, '__pycache__')
+        if not os.path.isdir(cache):
+            return
+        module = f[:-len('.py')]
+        for pyc in sorted(os.listdir(cache)):
+            parts = pyc.split('.')
+            if parts[0] == module and len(parts) == 3 and parts[2] == 'pyc':
+                return join_path(cache, pyc)
+
+    pending = zip_path + '.pending'
+    if os.path.isdir(pending):
+        for root, _, files in os.walk(pending, topdown=False):
+            for f in files:
+                src = join_path(root, f)
+                dest = join_path(lib, os.path.relpath(src, pending))
+                if not os.path.isdir(os.path.dirname(dest)):
+                    os.makedirs(os.path.dirname(dest))
+                if not os.path.exists(dest):
+                    os.rename(src, dest)
+        shutil.rmtree(pending)
+
+    names = [
+        name for name in sorted(os.listdir(lib))
+        if is_zip_safe(join_path(lib, name))
+    ]
+    files = []
+    for name in names:
+        path = join_path(lib, name)
+        if os.path.isfile(path):
+            files.append((lib, name))
+            continue
+        for src_root, subdirs, subfiles in os.walk(path):
+            subdirs[:] = [d for d in subdirs if d != '__pycache__']
+            files.extend((src_root, f) for f in subfiles if f.endswith('.py'))
+
+    # Stored instead of deflated so modules are read without decompressing
+    tmp_path = zip_path + '.tmp'
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED) as archive:
+        for src_root, f in files:
+            src = join_path(src_root, f)
+            arcname = os.path.relpath(src, lib).replace('\\', '/')
+            archive.write(src, arcname)
+            pyc = bytecode(src_root, f)
+            if pyc:
+                archive.write(pyc, arcname + 'c')
+
+    os.makedirs(pending)
+    for name in names:
+        path = join_path(lib, name)
+        if os.path.isfile(path):
+            pyc = bytecode(lib, name)
+            if pyc:
+                if not os.path.isdir(join_path(pending, '__pycache__')):
+                    os.makedirs(join_path(pending, '__pycache__'))
+                os.rename(pyc, join_path(pending, os.path.relpath(pyc, lib)))
+        os.rename(path, join_path(pending, name))
+    replace_file(tmp_path, zip_path)
+    shutil.rmtree(pending)
+
+    cache = join_path(lib, '__pycache__')
+    if os.path.isdir(cache) and not os.listdir(cache):
+        os.rmdir(cache)
+    return names
+
+
+# Virtualenv Templates
+def get_env_python(env_dir):
+    '''Get the path to the python executable in a virtualenv.'''
+
+    if PLATFORM == 'Windows':
+        return join_path(env_dir, 'Scripts', 'python.exe')
+    return join_path(env_dir, 'bin', 'python')
+
+
+def fix_paths(env_dir, old_path, new_path, script_dirs=('bin', 'Scripts')):
+    '''Replace old_path with new_path in the scripts and config of a
+    virtualenv.
+
+    Files are rewritten rather than modified in place so that files
+    linked to other virtualenvs are left untouched.
+    '''
+
+    candidates = [join_path(env_dir, 'pyvenv.cfg')]
+    for script_dir in script_dirs:
+        script_dir = join_path(env_dir, script_dir)
+        if os.path.isdir(script_dir):
+            candidates.extend(
+                join_path(script_dir, f) for f in os.listdir(script_dir)
+            )
+
+    old = old_path.encode('utf-8')
+    new = new_path.encode('utf-8')
+    old_native = os.path.normpath(old_path).encode('utf-8')
+    new_native = os.path.normpath(new_path).encode('utf-8')
+    for path in candidates:
+        if os.path.islink(path) or not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        if b'\0' in data or (old not in data and old_native not in data):
+            continue  # Binary or nothing to replace
+
+        debug('Fixing paths in %s', path)
+        data = data.replace(old, new)
+        if old_native != old:
+            data = data.replace(old_native, new_native)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        shutil.copymode(path, tmp_path)
+        replace_file(tmp_path, path)
+
+
+class VenvTemplate(object):
+    '''A virtualenv built once per interpreter and cloned for each version.
+
+    Cloning hardlinks or reflinks the template's files into the new
+    virtualenv and rewrites the scripts and config files that contain the
+    template's path. Console script launchers on Windows still point to the
+    template, construct only uses "python -m pip" so this is harmless.
+
+    Arguments:
+        root (str): Template directory (default: <where>/.cache/envs)
+        python (str): Base python interpreter, a path or a command on PATH
+        python_tag (str): Tag identifying the base interpreter
+    '''
+
+    stamp_name = '.template.json'
+    script_dirs = ('bin', 'Scripts')
+
+    def __init__(self, root, python, python_tag):
+        self.python = python
+        # Ask the interpreter for its path, python may be a bare command
+        self.python_path = os.path.realpath(
+            probe_python(python)['executable']
+        )
+        key = hashlib.sha1(self.python_path.encode('utf-8')).hexdigest()
+        self.path = join_path(root, python_tag + '-' + key[:8])
+        self.env_py = get_env_python(self.path)
+
+    def stamp(self):
+        '''Data identifying the base interpreter the template was built for.'''
+
+        stat = os.stat(self.python_path)
+        return {
+            'python': self.python_path,
+            'size': stat.st_size,
+            'mtime': int(stat.st_mtime),
+        }
+
+    def is_valid(self):
+        '''Check the template exists and its interpreter has not changed.'''
+
+        stamp_path = join_path(self.path, self.stamp_name)
+        if not os.path.isfile(stamp_path) or not os.path.exists(self.env_py):
+            return False
+        with open(stamp_path, 'r') as f:
+            return json.load(f) == self.stamp()
+
+    def build(self, cache=None, find_links=None):
+        '''Build the template in a staging directory then move it in place.'''
+
+        log('Building virtualenv template %s.', self.path)
+        parent = os.path.dirname(self.path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+
+        staging = tempfile.mkdtemp(prefix='.tmp_', dir=parent)
+        try:
+            env_dir = join_path(staging, 'env')
+            create_venv(
+                self.python,
+                env_dir,
+                get_env_python(env_dir),
+                cache,
+                find_links,
+            )
+            with open(join_path(env_dir, self.stamp_name), 'w') as f:
+                json.dump(self.stamp(), f)
+
+            # Rewrite the staging path so the template can be moved in place
+            fix_paths(env_dir, env_dir, self.path, self.script_dirs)
+            if os.path.isdir(self.path):
+                shutil.rmtree(self.path, ignore_errors=True)
+            try:
+                os.rename(env_dir, self.path)
+            except OSError:
+                pass  # Built by a concurrent install
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def clone(self, dest):
+        '''Clone the template to dest and fix up paths.'''
+
+        log('Cloning virtualenv template %s.', self.path)
+        for root, subdirs, files in os.walk(self.path):
+            dest_root = join_path(dest, os.path.relpath(root, self.path))
+            if not os.path.isdir(dest_root):
+                os.makedirs(dest_root)
+
+            for name in subdirs + files:
+                src = join_path(root, name)
+                if os.path.islink(src):
+                    target = os.readlink(src)
+                    if target.replace('\\', '/').startswith(self.path):
+                        target = dest + target[len(self.path):]
+                    os.symlink(target, join_path(dest_root, name))
+                    if name in subdirs:
+                        subdirs.remove(name)
+
+            for name in files:
+                src = join_path(root, name)
+                if name == self.stamp_name or os.path.islink(src):
+                    continue
+                try:
+                    link_file(src, join_path(dest_root, name))
+                except OSError:
+                    shutil.copy2(src, join_path(dest_root, name))
+
+        fix_paths(dest, self.path, dest, self.script_dirs)
+
+    def create(self, dest, cache=None, find_links=None):
+        '''Create a virtualenv at dest from the template, building the
+        template first if it is missing or out of date.'''
+
+        if os.path.exists(dest):
+            log('Virtualenv already exists %s.', dest)
+            return
+
+        if not self.is_valid():
+            self.build(cache, find_links)
+        else:
+            log('Using virtualenv template %s.', self.path)
+        self.clone(dest)
+
+
+def move_dir(src, dest, jobs=1):
+    '''Move a directory recursively.
+
+    When dest does not exist src is renamed to dest in a single atomic
+    operation. Otherwise the entries of src are renamed over the entries of
+    dest. When src and dest are on different filesystems the files are
+    copied in parallel using jobs threads instead.
+
+    Returns the number of files moved.
+    '''
+
+    if not os.path.isdir(src):
+        log('Nothing to move, %s does not exist.', src)
+        return 0
+
+    count = sum(len(files) for _, _, files in os.walk(src))
+    try:
+        if not os.path.exists(dest):
+            parent = os.path.dirname(dest)
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+            os.rename(src, dest)
+            log('Renamed %s to %s.', src, dest)
+            return count
+        merge_dir(src, dest)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        debug('%s and %s are on different filesystems.', src, dest)
+        copy_dir(src, dest, jobs)
+
+    shutil.rmtree(src)
+    log('Moved %d files to %s.', count, dest)
+    return count
+
+
+def merge_dir(src, dest):
+    '''Rename the entries of src over the entries of dest.
+
+    Directories that exist in both are merged recursively. Raises OSError
+    with errno EXDEV if src and dest are on different filesystems.
+    '''
+
+    if not os.path.isdir(dest):
+        os.makedirs(dest)
+
+    for name in os.listdir(src):
+        src_path = join_path(src, name)
+        dest_path = join_path(dest, name)
+        if os.path.isdir(src_path) and not os.path.islink(src_path):
+            if os.path.isdir(dest_path):
+                merge_dir(src_path, dest_path)
+                continue
+        debug('%s > %s', src_path, dest_path)
+        replace_file(src_path, dest_path)
+
+
+def copy_dir(src, dest, jobs=1):
+    '''Copy the files in src to dest using jobs threads.'''
+
+    paths = []
+    for src_root, subdirs, files in os.walk(src):
+        dest_root = join_path(dest, os.path.relpath(src_root, src))
+        if not os.path.isdir(dest_root):
+            os.makedirs(dest_root)
+        for f in files:
+            paths.append((join_path(src_root, f), join_path(dest_root, f)))
+
+    def copy(paths):
+        debug('%s > %s', *paths)
+        shutil.copy2(*paths)
+
+    for _, exc in parallel_map(copy, paths, jobs):
+        if exc:
+            raise exc
+
+
+def set_user_acls(where, jobs=4):
+    '''Set Windows Ownership and ACLs using powershell
+
+    Each entry in where is walked by its own icacls command, at most jobs at
+    a time.
+    '''
+
+    # Irritatingly, Set-Acl doesn't work, we have to use icacls
+    where = where.replace('/', '\\').rstrip('\\')
+    commands = []
+    for name in sorted(os.listdir(where)):
+        cmd = 'icacls %s /grant Users:(F) /inheritance:e /T' % escape(
+            where + '\\' + name
+        )
+        debug('%s', cmd)
+        commands.append(Command(cmd))
+    run_commands(commands, jobs)
+    if any(command.returncode != 0 for command in commands):
+        error('Failed to set permissions for %s', escape(where))
+
+
+def update_symlink(src, dest):
+    '''Creates or updates a symlink.
+
+    On Linux and Mac the symlink is replaced atomically.
+    '''
+
+    if PLATFORM == 'Windows':
+        src = os.path.normpath(src)
+        dest = os.path.normpath(dest)
+        if os.path.isdir(dest):
+            run('cmd.exe /C rmdir %s' % dest)
+        stdout, stderr = run('cmd.exe /C mklink /D %s %s' % (dest, src))
+    else:
+        # Rename a new link over dest so dest always exists
+        tmp_path = join_path(
+            os.path.dirname(dest),
+            '.%s.tmp' % os.path.basename(dest),
+        )
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        os.symlink(src, tmp_path)
+        replace_file(tmp_path, dest)
+
+
+def copy_scripts(dest, src=THIS_BIN):
+    '''Copies scripts from construct_setup/bin to dest'''
+
+    # Bat files
+    construct_bat = join_path(src, 'construct.bat')
+    cons_bat = join_path(dest, 'cons.bat')
+    log('%s -> %s', construct_bat, dest)
+    shutil.copy2(construct_bat, dest)
+    log('%s -> %s', cons_bat, dest)
+    shutil.copy2(construct_bat, cons_bat)
+
+    # Ps1 files
+    construct_ps1 = join_path(src, 'construct.ps1')
+    cons_ps1 = join_path(dest, 'cons.ps1')
+    log('%s -> %s', construct_ps1, dest)
+    shutil.copy2(construct_ps1, dest)
+    log('%s -> %s', construct_ps1, cons_ps1)
+    shutil.copy2(construct_ps1, cons_ps1)
+
+    # Bash files
+    construct_sh = join_path(src, 'construct.sh')
+    log('%s -> %s', construct_sh, dest)
+    shutil.copy2(construct_sh, dest)
+
+
+def write_pth(site, lib, bin, lib_zip=None):
+    '''Creates a pth file pointing to custom python lib directory.
+
+    When lib_zip is provided it is added before lib.
+    '''
+
+    paths = [lib, bin]
+    if lib_zip:
+        paths.insert(0, lib_zip)
+    paths = [os.path.relpath(path, site).replace('\\', '/') for path in paths]
+    site_path = join_path(site, 'construct.pth')
+    log('Writing %s.', site_path)
+    set_indent('    ' * 2)
+    for path in paths:
+        log(path)
+    set_indent('    ')
+    with open(site_path, 'w') as f:
+        f.write('\n'.join(paths))
+
+
+PROFILE_BEGIN = '# >>> construct >>>'
+PROFILE_END = '# <<< construct <<<'
+
+
+def update_profile(bash_profile_path, export_cmd, source_cmd, config_cmd=None):
+    '''Update bash profile on Linux and MacOS
+
+    Construct's commands are kept in a block between PROFILE_BEGIN and
+    PROFILE_END. The profile is replaced atomically and only written when the
+    block changes. Returns True if the profile was written.
+    '''
+
+    # Replace the file a symlinked profile points to, not the symlink
+    bash_profile_path = os.path.realpath(bash_profile_path)
+    try:
+        with open(bash_profile_path, 'r') as f:
+            bash_profile = f.read()
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        bash_profile = ''
+
+    commands = [cmd for cmd in (export_cmd, source_cmd, config_cmd) if cmd]
+    new_profile = replace_profile_block(bash_profile, commands)
+    if new_profile == bash_profile:
+        debug('%s is up to date.', bash_profile_path)
+        return False
+
+    if bash_profile:
+        debug('Creating backup profile %s.bak', bash_profile_path)
+        shutil.copy2(bash_profile_path, bash_profile_path + '.bak')
+    debug('Writing %s', bash_profile_path)
+    tmp_path = bash_profile_path + '.construct.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(new_profile)
+    if bash_profile:
+        shutil.copymode(bash_profile_path, tmp_path)
+    replace_file(tmp_path, bash_profile_path)
+    return True
+
+
+def replace_profile_block(bash_profile, commands):
+    '''Replace the construct block of a bash profile with commands.
+
+    Lines written by installers that did not use a block are removed, an
+    export of CONSTRUCT_CONFIG only when the block sets one itself. When
+    commands do not set CONSTRUCT_CONFIG the export from the existing block
+    is kept. The block is appended when the profile does not have one yet.
+    '''
+
+    config_prefix = 'export CONSTRUCT_CONFIG='
+    sets_config = any(cmd.startswith(config_prefix) for cmd in commands)
+
+    lines = []
+    kept = []
+    index = None
+    inside = False
+    for line in bash_profile.splitlines(True):
+        stripped = line.strip()
+        if stripped == PROFILE_BEGIN:
+            index = len(lines)
+            inside = True
+        elif stripped == PROFILE_END:
+            inside = False
+        elif inside:
+            if not sets_config and stripped.startswith(config_prefix):
+                kept.append(stripped)  # Set by an earlier --config
+            continue
+        elif (
+            stripped in commands
+            or (sets_config and stripped.startswith(config_prefix))
+        ):
+            continue  # Written by an older installer
+        else:
+            lines.append(line)
+
+    block = [PROFILE_BEGIN + '\n']
+    block.extend(cmd + '\n' for cmd in list(commands) + kept)
+    block.append(PROFILE_END + '\n')
+
+    if index is None:
+        if lines and not lines[-1].endswith('\n'):
+            lines[-1] += '\n'
+        if lines and lines[-1].strip():
+            lines.append('\n')
+        index = len(lines)
+    return ''.join(lines[:index] + block + lines[index:])
+
+
+# Step Graph
+STEP_JOBS = 4  # Install steps run at the same time
+
+
+class StepOutput(object):
+    '''Console output of a step held until it can be shown in order.
+
+    Once shown, output is printed as soon as it is written.
+    '''
+
+    def __init__(self):
+        self.lines = []
+        self.live = False
+        self._lock = threading.Lock()
+
+    def write(self, text, stream=None, **kwargs):
+        with self._lock:
+            if not self.live:
+                self.lines.append((text, stream, kwargs))
+                return
+        with _log_lock:
+            print(text, file=stream, **kwargs)
+
+    def show(self):
+        '''Print the held output and print any later output directly.'''
+
+        with self._lock:
+            with _log_lock:
+                for text, stream, kwargs in self.lines:
+                    print(text, file=stream, **kwargs)
+            self.lines = []
+            self.live = True
+
+
+class Step(object):
+    '''A step of a StepGraph.'''
+
+    def __init__(self, name, func, message, requires):
+        self.name = name
+        self.func = func
+        self.message = message
+        self.requires = requires
+        self.number = None
+        self.status = None
+        self.error = None
+        self.output = StepOutput()
+
+    @property
+    def label(self):
+        return '%d. %s' % (self.number, self.message)
+
+
+class StepGraph(object):
+    '''Install steps and the steps each of them requires.
+
+    run starts each step as soon as the steps it requires completed, so
+    independent steps run at the same time. Steps are numbered in the order
+    they were added and their console output is shown in that order, the
+    output reads the same as if the steps ran one after another.
+
+    Example:
+        graph = installer.steps()
+        graph.add(
+            'notify',
+            notify_farm,
+            'Notify render farm...',
+            requires=['activate'],
+        )
+        installer.run(graph)
+    '''
+
+    def __init__(self):
+        self.steps = collections.OrderedDict()
+
+    def __contains__(self, name):
+        return name in self.steps
+
+    def __getitem__(self, name):
+        return self.steps[name]
+
+    def __iter__(self):
+        return iter(self.steps.values())
+
+    def add(self, name, func, message, *args, **kwargs):
+        '''Add a step.
+
+        Arguments:
+            name (str): Name other steps use to require this step
+            func (callable): Called without arguments to run the step
+            message (str): Console message formatted with args
+            requires (list): Names of steps that must complete first, they
+                must already be added
+
+        Returns the new Step.
+        '''
+
+        requires = list(kwargs.pop('requires', []))
+        if kwargs:
+            raise TypeError('Unexpected arguments: %s' % ', '.join(kwargs))
+        if name in self.steps:
+            raise ValueError('Step %s already added.' % name)
+        missing = [r for r in requires if r not in self.steps]
+        if missing:
+            raise ValueError(
+                'Step %s requires unknown steps: %s' %
+                (name, ', '.join(missing))
+            )
+        step = Step(name, func, message % args, requires)
+        self.steps[name] = step
+        return step
+
+    def run(self, jobs=STEP_JOBS):
+        '''Run all steps using at most jobs threads.
+
+        Once any step fails no more steps are started and the install is
+        aborted after the running steps finish.
+        '''
+
+        steps = list(self.steps.values())
+        for i, step in enumerate(steps):
+            step.number = _count + i
+        set_step(_count + len(steps))
+
+        pending = list(steps)
+        running = set()
+        done = set()
+        finished = queue.Queue()
+        shown = 0
+        failed = []
+        try:
+            while True:
+                if not failed:
+                    for step in list(pending):
+                        if len(running) >= max(jobs, 1):
+                            break
+                        if all(name in done for name in step.requires):
+                            pending.remove(step)
+                            running.add(step.name)
+                            thread = threading.Thread(
+                                target=self._run_step,
+                                args=(step, finished),
+                            )
+                            thread.daemon = True
+                            thread.start()
+
+                # Show finished steps in order, then follow the next one
+                while shown < len(steps) and steps[shown].status:
+                    steps[shown].output.show()
+                    shown += 1
+                if shown < len(steps) and steps[shown].name in running:
+                    steps[shown].output.show()
+
+                if not running:
+                    break
+                try:
+                    # Use a timeout so Ctrl-C interrupts the wait on Python 2
+                    step = finished.get(timeout=WAIT_INTERVAL)
+                except queue.Empty:
+                    continue
+                running.discard(step.name)
+                if step.status == 'ok':
+                    done.add(step.name)
+                else:
+                    failed.append(step)
+        except KeyboardInterrupt:
+            # Commands run in their own process group, kill them and stop
+            # starting new steps
+            del pending[:]
+            interrupt_commands()
+            raise
+
+        if failed:
+            for step in steps[shown:]:
+                if step.status:
+                    step.output.show()
+            step = min(failed, key=lambda step: step.number)
+            _events.step = step.label
+            if isinstance(step.error, AbortError):
+                abort(str(step.error))
+            try:
+                raise step.error
+            except Exception:
+                abort('Install step failed...')
+
+    def _run_step(self, step, finished):
+        set_context({'output': step.output, 'indent': '', 'step': None})
+        _events.step = step.label
+        log('\n%s', step.label)
+        record = _tracer.begin_step(step.label)
+        set_indent('    ')
+        try:
+            step.func()
+            log('OK!')
+            _tracer.end_step(record, 'ok')
+            step.status = 'ok'
+        except Exception as e:
+            _tracer.end_step(record, 'failed')
+            step.error = e
+            step.status = 'failed'
+        finally:
+            set_indent('')
+            finished.put(step)
+
+
+class Installer(object):
+    '''Construct Installer...
+
+    Arguments:
+        version (str): x.x.x version string
+        name (str): Optional name to use instead of version string
+        python (str): Path to python interpreter to use
+        where (str): Install directory(defaults: C:/Construct, /opt/construct)
+        config (str): Path to construct configuration file
+        local (str): If True install from current working directory
+        ignore_prompts (bool): Ignore install prompts if True
+        jobs (int): Number of packages to build concurrently
+        cache (str): Wheel cache directory (default: <where>/.cache/wheels)
+        cache_size (int): Maximum size of the wheel cache in megabytes
+        no_cache (bool): Disable the wheel cache if True
+        bundle_in (str): Install offline from a bundle created by
+            export_bundle
+        dedupe (bool): Hardlink lib files from an ObjectStore in <where>
+        incremental (bool): Only install packages that changed since the
+            version the current symlink points to
+        trace (bool): Write a Chrome trace event file next to the install
+            report
+        venv_template (bool): Clone the virtualenv from a template built once
+            per interpreter in <where>/.cache/envs
+        bytecode (str): Bytecode invalidation mode used to precompile lib,
+            one of BYTECODE_MODES (default: checked-hash)
+        zip_lib (bool): Move the pure python packages in lib to lib.zip
+        no_resume (bool): Run every step even if a previous failed run of
+            this install completed it
+        smoke_test (bool): Import each dependency and run cons -h before
+            activating the install
+        latency_budget (float): Seconds each smoke test may take
+        locked (str): Install the packages pinned by a lockfile created by
+            export_lock instead of resolving dependencies
+        verify (bool): Hash the contents of an existing install to check
+            it is unchanged before skipping it
+        sources (str): JSON file mapping git url prefixes to the prefixes
+            that replace them, see read_sources
+        mirror (bool): Install git dependencies from bare mirrors kept in
+            <where>/.cache/git
+        no_profile (bool): Do not add construct to the bash profile, PATH
+            or set CONSTRUCT_CONFIG
+    '''
+    def __init__(
+        self,
+        version,
+        name,
+        python,
+        where,
+        config,
+        local,
+        ignore_prompts=False,
+        jobs=DEFAULT_JOBS,
+        cache=None,
+        cache_size=DEFAULT_CACHE_SIZE,
+        no_cache=False,
+        bundle_in=None,
+        dedupe=False,
+        incremental=False,
+        trace=False,
+        venv_template=False,
+        bytecode=DEFAULT_BYTECODE,
+        zip_lib=False,
+        no_resume=False,
+        smoke_test=False,
+        latency_budget=DEFAULT_LATENCY_BUDGET,
+        locked=None,
+        verify=False,
+        sources=None,
+        mirror=False,
+        no_profile=False,
+    ):
+        self.version = version
+        self.name = name or version
+        self.python = python
+        self.where = os.path.abspath(where)
+        self.config = os.path.abspath(config) if config else None
+        self.pip_package = '.' if local else PIP_PACKAGE % version
+        self.ignore_prompts = ignore_prompts
+        self.jobs = jobs
+        self.local = local
+        self.bundle_in = bundle_in and os.path.abspath(bundle_in)
+        self.bundle_manifest = None
+        self.dedupe = dedupe
+        self.incremental = incremental
+        self.trace = trace
+        self.venv_template = venv_template
+        self.bytecode = bytecode
+        self.zip_lib = zip_lib
+        self.no_resume = no_resume
+        self.smoke_test = smoke_test
+        self.latency_budget = latency_budget
+        self.locked = locked and os.path.abspath(locked)
+        self.verify = verify
+        self.sources = read_sources(sources) if sources else {}
+        self.mirror = mirror
+        self.no_profile = no_profile
+        self.install_path = join_path(self.where, self.name)
+        self.install_current = join_path(self.where, 'current')
+        self.install_previous = join_path(self.where, 'previous')
+        self.store = ObjectStore(join_path(self.where, '.store'))
+        self.probe = probe_python(python)
+        self.python_tag = self.probe['python_tag']
+
+        # Build in a staging directory and move it in place once it works.
+        # Windows console script launchers contain absolute paths so the
+        # install is built in place there.
+        self.stage_path = self.install_path
+        if PLATFORM != 'Windows':
+            self.stage_path = join_path(self.where, STAGING_DIR, self.name)
+        self.set_paths(self.stage_path)
+
+        self.cache = None
+        if not no_cache:
+            self.cache = WheelCache(
+                cache or join_path(self.where, '.cache', 'wheels'),
+                self.python_tag,
+                cache_size,
+            )
+
+    def set_paths(self, path):
+        '''Set the paths of the version's folders relative to path.'''
+
+        self.install_lib = join_path(path, 'lib')
+        self.install_lib_bin = join_path(self.install_lib, 'bin')
+        self.install_lib_zip = join_path(path, LIB_ZIP)
+        self.install_bin = join_path(path, 'bin')
+        self.install_env = join_path(path, 'python')
+        self.install_bundle = join_path(path, '.bundle')
+        self.install_py = get_env_python(self.install_env)
+        self.install_site = join_path(
+            self.install_env,
+            self.probe['site_packages'],
+        )
+        self.checkpoints = Checkpoints(join_path(path, INSTALL_CHECKPOINTS))
+
+    def run(self, graph=None):
+        '''Run the installer including any platform specific install steps.
+
+        Pass a graph returned by steps() to run it with steps added by the
+        caller. run configures git, loads checkpoints and writes the install
+        report and log around the graph, so always run the graph through it.
+        '''
+
+        if self.is_installed():
+            log(
+                '\nConstruct-%s is already installed to "%s".',
+                self.version,
+                self.install_path,
+            )
+            return
+
+        trace_path = None
+        if self.trace:
+            trace_path = join_path(self.stage_path, INSTALL_TRACE)
+        _tracer.begin(
+            join_path(self.stage_path, INSTALL_REPORT),
+            trace_path,
+            version=self.version,
+            name=self.name,
+            python=self.python,
+            python_tag=self.python_tag,
+            where=self.where,
+            platform=PLATFORM,
+        )
+        _events.begin(join_path(self.stage_path, INSTALL_LOG))
+        log(
+            '\nInstalling Construct-%s to "%s".',
+            self.version,
+            self.install_path,
+        )
+        log('Using "%s".', self.python)
+
+        self.configure_git()
+        if self.no_resume:
+            self.checkpoints.clear()
+        self.checkpoints.load()
+        if self.checkpoints.completed:
+            log('\nResuming install from %s.', self.checkpoints.path)
+
+        if graph is None:
+            graph = self.steps()
+        graph.run()
+
+        if self.bundle_in:
+            shutil.rmtree(self.install_bundle, ignore_errors=True)
+
+        _tracer.save()
+        log('\nInstall report written to %s.', _tracer.report_path)
+        log('Install log written to %s.',
+            join_path(self.install_path, INSTALL_LOG))
+        log('\nInstall complete!')
+        log('\nYou should now have access to the construct cli.\n')
+        log('    cons -h')
+        _events.close()
+
+    def install_inputs(self):
+        '''Get the options that determine the contents of the install.'''
+
+        bundle = None
+        if self.bundle_in:
+            stat = os.stat(self.bundle_in)
+            bundle = [self.bundle_in, stat.st_size, stat.st_mtime]
+        return {
+            'version': self.version,
+            'pip_package': self.pip_package,
+            'locked': self.locked and file_digest(self.locked),
+            'bundle': bundle,
+            'bytecode': self.bytecode,
+            'zip_lib': self.zip_lib,
+            'dedupe': self.dedupe,
+            'config': self.config,
+        }
+
+    def is_installed(self):
+        '''Check if this install is already active and unchanged.
+
+        The manifest written by the last install is compared to this
+        install's options, interpreter, installed distributions and tree.
+        The tree is compared by size and modified time, or by contents
+        when verify is True. Local installs are never skipped.
+        '''
+
+        if self.local or self.no_resume:
+            return False
+        manifest = read_manifest(self.install_path)
+        if not manifest or 'tree' not in manifest:
+            return False
+        if not os.path.exists(self.install_current):
+            return False
+        if join_path(os.path.realpath(self.install_current)) != (
+            self.install_path
+        ):
+            return False
+        if manifest['inputs'] != normalize_json(self.install_inputs()):
+            debug('Install options changed.')
+            return False
+        fingerprint = normalize_json(python_fingerprint(self.python))
+        if manifest['fingerprint'] != fingerprint:
+            debug('Python interpreter changed.')
+            return False
+        lib = join_path(self.install_path, 'lib')
+        if not os.path.isdir(lib) or get_dist_pins(lib) != manifest['pins']:
+            debug('Installed distributions changed.')
+            return False
+
+        files = get_tree_files(self.install_path, INSTALL_TREE)
+        if not self.verify:
+            if tree_digest(self.install_path, files) != manifest['tree']:
+                debug('Files in %s changed.', self.install_path)
+                return False
+            return True
+
+        log('\nVerifying %d files in %s...', len(files), self.install_path)
+        diff = diff_tree(
+            manifest['files'],
+            hash_tree(self.install_path, files, max(self.jobs, HASH_JOBS)),
+        )
+        for name, status in diff:
+            log('    %s %s', status.capitalize(), name)
+        if diff:
+            log('Found %d changed files, reinstalling.', len(diff))
+            return False
+        return True
+
+    def write_install_manifest(self):
+        '''Record the options, interpreter, installed distributions and tree
+        of the install so a rerun can tell when nothing has changed.'''
+
+        start = time.time()
+        files = get_tree_files(self.install_path, INSTALL_TREE)
+        manifest = read_manifest(self.install_path) or {}
+        manifest.update({
+            'version': self.version,
+            'python_tag': self.python_tag,
+            'inputs': self.install_inputs(),
+            'fingerprint': python_fingerprint(self.python),
+            'pins': get_dist_pins(self.install_lib),
+            'tree': tree_digest(self.install_path, files),
+            'files': hash_tree(
+                self.install_path,
+                files,
+                max(self.jobs, HASH_JOBS),
+            ),
+        })
+        write_manifest(self.install_path, manifest)
+        log('Hashed %d files in %.1fs.', len(files), time.time() - start)
+
+    def steps(self):
+        '''Get the install steps as a StepGraph.
+
+        Each step requires only the steps it depends on, so independent steps
+        run at the same time. Tools driving the Installer directly can add
+        their own steps and pass the graph to run.
+        '''
+
+        graph = StepGraph()
+        graph.add(
+            'ensure_dirs',
+            self.ensure_dirs,
+            'Ensure install directories exist...',
+        )
+
+        find_links = None
+        scripts = THIS_BIN
+        bundle = []
+        if self.bundle_in:
+            stat = os.stat(self.bundle_in)
+            graph.add(
+                'unpack_bundle',
+                self.checkpointed(
+                    'unpack_bundle',
+                    [self.bundle_in, stat.st_size, stat.st_mtime],
+                    self.unpack_bundle,
+                ),
+                'Unpack bundle %s...', self.bundle_in,
+                requires=['ensure_dirs'],
+            )
+            find_links = [join_path(self.install_bundle, 'pip')]
+            scripts = join_path(self.install_bundle, 'bin')
+            bundle = ['unpack_bundle']
+
+        mirrors = []
+        if self.mirror and not self.bundle_in:
+            graph.add(
+                'update_mirrors',
+                self.update_mirrors,
+                'Update git mirrors in %s...',
+                join_path(self.where, GIT_MIRRORS_DIR),
+                requires=['ensure_dirs'],
+            )
+            mirrors = ['update_mirrors']
+
+        graph.add(
+            'create_venv',
+            self.checkpointed(
+                'create_venv',
+                [self.probe['executable'], self.probe['version_info']],
+                lambda: self.create_venv(find_links),
+            ),
+            'Create python virtualenv...',
+            requires=['ensure_dirs'] + bundle,
+        )
+        graph.add(
+            'write_pth',
+            lambda: write_pth(
+                self.install_site,
+                self.install_lib,
+                self.install_bin,
+                self.install_lib_zip if self.zip_lib else None,
+            ),
+            'Add pth file to virtualenv...',
+            requires=['create_venv'],
+        )
+        graph.add(
+            'install',
+            self.checkpointed(
+                'install',
+                None if self.local else [
+                    self.version,
+                    self.pip_package,
+                    self.locked and file_digest(self.locked),
+                    self.incremental,
+                    self.dedupe,
+                ],
+                self.install,
+            ),
+            'Install construct to virtualenv...',
+            requires=['create_venv'] + mirrors,
+        )
+        graph.add(
+            'move_scripts',
+            lambda: move_dir(
+                self.install_lib_bin,
+                self.install_bin,
+                self.jobs,
+            ),
+            'Move installed python console scripts...',
+            requires=['install'],
+        )
+
+        # Steps that modify lib run one after another
+        lib = 'move_scripts'
+        if self.bytecode != 'none':
+            graph.add(
+                'compile',
+                self.checkpointed(
+                    'compile',
+                    [self.bytecode],
+                    self.compile_lib,
+                ),
+                'Compile bytecode...',
+                requires=[lib],
+            )
+            lib = 'compile'
+        if self.zip_lib:
+            graph.add(
+                'zip_lib',
+                self.checkpointed('zip_lib', [], self.zip_lib_packages),
+                'Zip pure python packages to %s...', LIB_ZIP,
+                requires=[lib],
+            )
+            lib = 'zip_lib'
+        if self.dedupe:
+            graph.add(
+                'dedupe',
+                self.checkpointed('dedupe', [self.store.root], self.link_lib),
+                'Link lib files to %s...', self.store.root,
+                requires=[lib],
+            )
+            lib = 'dedupe'
+
+        graph.add(
+            'validate',
+            self.validate,
+            'Validate install...',
+            requires=[lib, 'write_pth'],
+        )
+        tested = 'validate'
+        if self.smoke_test:
+            graph.add(
+                'smoke_test',
+                self.run_smoke_tests,
+                'Smoke test install...',
+                requires=['validate'],
+            )
+            tested = 'smoke_test'
+
+        graph.add(
+            'copy_scripts',
+            lambda: copy_scripts(self.where, scripts),
+            'Install construct and cons shell scripts...',
+            requires=['ensure_dirs'] + bundle,
+        )
+        graph.add(
+            'activate',
+            self.activate,
+            'Activate %s...', self.install_path,
+            requires=[tested, 'copy_scripts'],
+        )
+
+        # Add platform specific install steps
+        {
+            'Windows': self.windows_steps,
+            'Mac': self.mac_steps,
+            'Linux': self.unix_steps,
+        }[PLATFORM](graph)
+
+        graph.add(
+            'write_manifest',
+            self.write_install_manifest,
+            'Write install manifest...',
+            requires=[step.name for step in graph],
+        )
+        return graph
+
+    def configure_git(self, mirrors=None):
+        '''Redirect git url prefixes using sources, or point requirements of
+        the repositories of updated GitMirrors at their mirrors.
+
+        Sources are set in os.environ once, before any steps start, mirrors
+        only change _mirror_urls so steps running at the same time never see
+        os.environ change. Mirrors are not registered with
+        url.<base>.insteadOf, it matches prefixes so it would also redirect
+        repositories that are not mirrored but whose urls start with a
+        mirrored url.
+        '''
+
+        if mirrors:
+            url_map = mirrors.url_map()
+            for url in sorted(url_map):
+                debug('Using mirror %s for %s', url_map[url], url)
+            _mirror_urls.update(url_map)
+        elif self.sources:
+            for prefix in sorted(self.sources):
+                debug('Redirecting %s to %s', prefix, self.sources[prefix])
+            os.environ.update(git_url_env(self.sources))
+
+    def update_mirrors(self):
+        '''Update the git mirrors of construct_setup and of the repositories
+        its setup.py requires, then redirect git to the mirrors.'''
+
+        mirrors = GitMirrors(
+            join_path(self.where, GIT_MIRRORS_DIR),
+            self.sources,
+        )
+        if os.path.isdir(self.pip_package):
+            with open(join_path(self.pip_package, 'setup.py'), 'r') as f:
+                setup_py = f.read()
+        else:
+            url, ref = split_git_url(self.pip_package)
+            log('Updating %s', mirrors.path(url))
+            mirrors.update_all([url])
+            setup_py = mirrors.show(url, ref or 'HEAD', 'setup.py')
+
+        urls = read_setup_git_urls(setup_py)
+        log('Updating %d mirrors...', len(urls))
+        start = time.time()
+        mirrors.update_all(urls, max(self.jobs, GIT_FETCH_JOBS))
+        log('Updated mirrors in %.1fs.', time.time() - start)
+        self.configure_git(mirrors)
+
+    def ensure_dirs(self):
+        '''Create the install and staging directories.'''
+
+        ensure_exists(self.where)
+        ensure_exists(self.stage_path)
+
+    def checkpointed(self, name, inputs, func):
+        '''Wrap func so it is skipped when a previous run of this install
+        already completed it with the same inputs.'''
+
+        def run():
+            if self.checkpoints.begin(name, inputs):
+                log('Completed by a previous run, skipping.')
+                return
+            func()
+            self.checkpoints.end()
+        return run
+
+    def create_venv(self, find_links=None):
+        '''Create the virtualenv, cloning it from a template if enabled.'''
+
+        if self.venv_template:
+            template = VenvTemplate(
+                join_path(self.where, '.cache', 'envs'),
+                self.python,
+                self.python_tag,
+            )
+            template.create(self.install_env, self.cache, find_links)
+        else:
+            create_venv(
+                self.python,
+                self.install_env,
+                self.install_py,
+                self.cache,
+                find_links,
+            )
+
+    def install(self):
+        '''Install construct and its dependencies to lib.'''
+
+        if self.bundle_in:
+            self.install_bundled_wheels()
+        elif self.locked:
+            self.install_locked_wheels()
+        elif self.jobs > 1 or self.cache or self.incremental:
+            self.install_wheels()
+        else:
+            pip_install(
+                self.install_py,
+                '-I',  # Ignore installed
+                '-U',  # Force upgrade
+                '--no-compile',
+                self.pip_package,
+                '--target=%s' % self.install_lib
+            )
+
+    def compile_lib(self):
+        '''Compile lib to bytecode.'''
+
+        start = time.time()
+        if not compile_bytecode(
+            self.python,
+            self.install_lib,
+            self.bytecode,
+            join_path(self.install_path, 'lib'),
+        ):
+            warning('Some files in %s failed to compile.', self.install_lib)
+        log('Compiled %s in %.1fs.', self.install_lib, time.time() - start)
+
+    def zip_lib_packages(self):
+        '''Move the pure python packages in lib to lib.zip.'''
+
+        zipped = zip_packages(self.install_lib, self.install_lib_zip)
+        unpacked = [
+            name for name in os.listdir(self.install_lib)
+            if not name.endswith(('.dist-info', '.egg-info'))
+            and name != '__pycache__'
+        ]
+        log('Zipped %d packages, %d left unpacked.',
+            len(zipped), len(unpacked))
+        for name in sorted(unpacked):
+            debug('Not zip safe: %s', name)
+
+    def link_lib(self):
+        '''Hardlink the files in lib from the object store.'''
+
+        files, new_objects, shared = self.store.add_tree(
+            self.install_lib,
+            self.jobs,
+        )
+        log('Stored %d files, %d new objects, %d MB shared.',
+            files, new_objects, shared // (1024 * 1024))
+
+    def validate(self):
+        '''Check the staged install works before activating it.'''
+
+        lib = self.install_lib
+        if not os.path.isdir(lib) or not os.listdir(lib):
+            raise RuntimeError('Nothing was installed to %s.' % lib)
+        run(escape(self.install_py) + ' -c "import sys"')
+
+    def run_smoke_tests(self):
+        '''Import each dependency and run cons -h with the installed python.
+
+        Raises RuntimeError if any of them fail or take longer than the
+        latency budget.
+        '''
+
+        env = os.environ.copy()
+        env['PATH'] = os.pathsep.join([self.install_bin, env.get('PATH', '')])
+        env['PYTHONPATH'] = os.pathsep.join(
+            [self.install_lib_zip, self.install_lib, env.get('PYTHONPATH', '')]
+        )
+
+        tests = []
+        for name, modules in get_dependency_modules(self.install_lib):
+            for module in modules:
+                tests.append(('import ' + module, ['-c', 'import ' + module]))
+        entry_point = find_entry_point(self.install_lib, SMOKE_CLI)
+        if not entry_point:
+            raise RuntimeError('No %s console script installed.' % SMOKE_CLI)
+        module, _, attrs = entry_point.partition(':')
+        tests.append((
+            ' '.join(['cons'] + SMOKE_CLI_ARGS),
+            ['-c', SMOKE_CLI_SCRIPT % (
+                ['cons'] + SMOKE_CLI_ARGS,
+                module,
+                attrs.split('.'),
+            )],
+        ))
+
+        failures = []
+        for label, args in tests:
+            returncode, output, seconds = run_timed(
+                [self.install_py.strip('"')] + args,
+                env,
+            )
+            if returncode != 0:
+                status = 'failed'
+                failures.append(label)
+                for line in output.strip().splitlines()[-20:]:
+                    log('    %s', line)
+            elif seconds > self.latency_budget:
+                status = 'too slow'
+                failures.append(label)
+            else:
+                status = 'ok'
+            log('%-40s %8.0f ms  %s', label, seconds * 1000, status)
+
+        if failures:
+            raise RuntimeError(
+                'Smoke tests failed or exceeded the %gs budget: %s' %
+                (self.latency_budget, ', '.join(failures))
+            )
+
+    def activate(self):
+        '''Move the staged install in place and point current at it.
+
+        The version current pointed to is recorded by the previous symlink
+        so the rollback command can switch back to it. Reinstalling the
+        current version replaces its tree and leaves previous alone.
+        '''
+
+        self.checkpoints.clear()  # The install completed
+        replaced = None
+        if self.stage_path != self.install_path:
+            # Fix paths before touching the live version so it is only
+            # missing between the two renames
+            fix_paths(self.install_env, self.stage_path, self.install_path)
+            fix_paths(
+                self.stage_path,
+                self.stage_path,
+                self.install_path,
+                script_dirs=('bin',),
+            )
+            if os.path.exists(self.install_path):
+                replaced = '%s.old-%d' % (self.stage_path, time.time())
+                debug('Moving %s to %s', self.install_path, replaced)
+                os.rename(self.install_path, replaced)
+            log('Moving %s to %s.', self.stage_path, self.install_path)
+            try:
+                os.rename(self.stage_path, self.install_path)
+            except OSError:
+                if replaced:
+                    os.rename(replaced, self.install_path)
+                raise
+            self.set_paths(self.install_path)
+            _tracer.report_path = join_path(self.install_path, INSTALL_REPORT)
+            if _tracer.trace_path:
+                _tracer.trace_path = join_path(
+                    self.install_path,
+                    INSTALL_TRACE,
+                )
+
+        if os.path.exists(self.install_current):
+            active = join_path(os.path.realpath(self.install_current))
+            if active != self.install_path:
+                log('Previous version %s.', active)
+                update_symlink(active, self.install_previous)
+        update_symlink(self.install_path, self.install_current)
+
+        if replaced:
+            shutil.rmtree(replaced, ignore_errors=True)
+
+    def resolve_wheels(self, python, wheelhouse, reuse=None):
+        '''Build or fetch cached wheels for all dependencies concurrently.
+
+        Requirements in the reuse dict are not built, their value is used as
+        the list of wheels they require instead.
+
+        Returns a tuple containing the requirements read from setup.py, the
+        list of wheels to install including construct_setup's wheel and a
+        dict mapping each requirement to the wheels it requires.
+        '''
+
+        setup_dir = join_path(wheelhouse, 'construct_setup')
+        try:
+            setup_wheel, requirements = resolve_dependencies(
+                python,
+                self.pip_package,
+                setup_dir,
+                None if self.local else self.cache,
+            )
+        except BuildError as e:
+            report_build_failures([e])
+            abort('Failed to resolve dependencies.')
+        for requirement in requirements:
+            log('    %s', requirement_name(requirement))
+
+        reuse = reuse or {}
+        changed = [r for r in requirements if r not in reuse]
+        if reuse:
+            log('%d packages unchanged.', len(requirements) - len(changed))
+
+        log('Building %d packages using %d jobs...',
+            len(changed), self.jobs)
+        wheel_dirs, failures = build_wheels(
+            python,
+            changed,
+            wheelhouse,
+            self.jobs,
+            self.cache,
+        )
+        if failures:
+            report_build_failures(failures)
+            abort('Failed to build %d of %d packages.',
+                  len(failures), len(changed))
+
+        requirement_wheels = dict(reuse)
+        for requirement, wheel_dir in zip(changed, wheel_dirs):
+            requirement_wheels[requirement] = find_wheels(wheel_dir)
+        wheels = select_wheels(
+            requirement_wheels[requirement] for requirement in requirements
+        )
+        return requirements, [setup_wheel] + wheels, requirement_wheels
+
+    def previous_install(self):
+        '''Get the path and manifest of the install to upgrade from.
+
+        This is the install the current symlink points to. Returns None when
+        it has no manifest or was installed for another interpreter.
+        '''
+
+        if not os.path.exists(self.install_current):
+            return
+        path = join_path(os.path.realpath(self.install_current))
+        manifest = read_manifest(path)
+        if not manifest:
+            warning('%s has no %s.', path, INSTALL_MANIFEST)
+            return
+        if manifest['python_tag'] != self.python_tag:
+            warning('%s was installed for %s.', path, manifest['python_tag'])
+            return
+        if os.path.exists(join_path(path, LIB_ZIP)):
+            warning('%s has a zipped lib.', path)
+            return
+        return path, manifest
+
+    def install_wheels(self):
+        '''Build or fetch cached wheels for all dependencies then install
+        them at once.'''
+
+        previous_path, previous = None, {}
+        if self.incremental:
+            previous_install = self.previous_install()
+            if previous_install:
+                previous_path, previous = previous_install
+                log('Upgrading from %s.', previous_path)
+
+        wheelhouse = tempfile.mkdtemp(prefix='construct_wheels_')
+        try:
+            requirements, wheels, requirement_wheels = self.resolve_wheels(
+                self.install_py,
+                wheelhouse,
+                previous.get('requirements'),
+            )
+
+            # Wheels installed by the previous install are copied from it,
+            # construct_setup's wheel is always installed for its metadata
+            # On Windows console scripts are binary launchers that embed the
+            # interpreter path, so wheels with scripts are reinstalled
+            previous_wheels = previous.get('wheels', {})
+            copied = [
+                wheel for wheel in wheels[1:]
+                if os.path.basename(wheel) in previous_wheels
+                and not (
+                    PLATFORM == 'Windows'
+                    and has_scripts(previous_wheels[os.path.basename(wheel)])
+                )
+            ]
+            if previous_path != self.stage_path:
+                for wheel in copied:
+                    name = os.path.basename(wheel)
+                    log('Copying %s', name)
+                    copy_installed_files(
+                        previous_wheels[name],
+                        join_path(previous_path, 'lib'),
+                        join_path(previous_path, 'bin'),
+                        self.install_lib,
+                        link=self.dedupe,
+                        jobs=self.jobs,
+                    )
+            else:
+                selected = set(os.path.basename(w) for w in wheels)
+                for name, files in previous_wheels.items():
+                    if name not in selected:
+                        log('Removing %s', name)
+                        remove_installed_files(files, self.install_lib)
+
+            installed = [wheel for wheel in wheels if wheel not in copied]
+            if installed:
+                pip_install(
+                    self.install_py,
+                    '-I',  # Ignore installed
+                    '-U',  # Force upgrade
+                    '--no-deps',
+                    '--no-index',
+                    '--no-compile',
+                    '--target=%s' % self.install_lib,
+                    *[escape(wheel) for wheel in installed]
+                )
+
+            installed_files = {}
+            for wheel in wheels:
+                name = os.path.basename(wheel)
+                if name in previous_wheels:
+                    installed_files[name] = previous_wheels[name]
+                else:
+                    installed_files[name] = get_installed_files(
+                        self.install_lib,
+                        wheel,
+                    )
+            write_manifest(self.stage_path, {
+                'version': self.version,
+                'python_tag': self.python_tag,
+                'requirements': dict(
+                    (requirement, [
+                        os.path.basename(wheel)
+                        for wheel in requirement_wheels[requirement]
+                    ])
+                    for requirement in requirements
+                ),
+                'wheels': installed_files,
+            })
+        finally:
+            shutil.rmtree(wheelhouse, ignore_errors=True)
+
+        if self.cache:
+            self.cache.evict()
+
+    def unpack_bundle(self):
+        '''Unpack the wheels and scripts in bundle_in to install_bundle.'''
+
+        if os.path.isdir(self.install_bundle):
+            shutil.rmtree(self.install_bundle)
+        manifest = unpack_bundle(self.bundle_in, self.install_bundle)
+        log('Construct-%s bundle built for %s.',
+            manifest['version'], manifest['python_tag'])
+
+        if manifest['python_tag'] != self.python_tag:
+            platform_wheels = [
+                wheel for wheel in manifest['wheels']
+                if not is_pure_wheel(wheel)
+            ]
+            if platform_wheels:
+                abort(
+                    'Bundle contains wheels for %s but %s is %s:\n    %s',
+                    manifest['python_tag'],
+                    self.python,
+                    self.python_tag,
+                    '\n    '.join(platform_wheels),
+                )
+        self.bundle_manifest = manifest
+
+    def install_bundled_wheels(self):
+        '''Install the wheels unpacked from bundle_in without any network
+        access.'''
+
+        if self.bundle_manifest is None:
+            # Unpacked by a previous run of this install
+            self.bundle_manifest = read_bundle_manifest(self.bundle_in)
+        wheels_dir = join_path(self.install_bundle, 'wheels')
+        wheels = [
+            join_path(wheels_dir, wheel)
+            for wheel in self.bundle_manifest['wheels']
+        ]
+        pip_install(
+            self.install_py,
+            '-I',  # Ignore installed
+            '-U',  # Force upgrade
+            '--no-deps',
+            '--no-index',
+            '--no-compile',
+            '--target=%s' % self.install_lib,
+            *[escape(wheel) for wheel in wheels]
+        )
+
+    def install_locked_wheels(self):
+        '''Fetch the exact wheels in the locked lockfile concurrently and
+        install them without resolving dependencies.'''
+
+        wheelhouse = tempfile.mkdtemp(prefix='construct_wheels_')
+        try:
+            _, wheels = self.fetch_locked_wheels(wheelhouse)
+            pip_install(
+                self.install_py,
+                '-I',  # Ignore installed
+                '-U',  # Force upgrade
+                '--no-deps',
+                '--no-index',
+                '--no-compile',
+                '--target=%s' % self.install_lib,
+                *[escape(wheel) for wheel in wheels]
+            )
+        finally:
+            shutil.rmtree(wheelhouse, ignore_errors=True)
+
+    def fetch_locked_wheels(self, wheelhouse):
+        '''Fetch the exact wheels in the locked lockfile concurrently to
+        wheelhouse.
+
+        Returns a tuple containing the locked requirements and the list of
+        wheels.
+        '''
+
+        lock = read_lockfile(self.locked)
+        if lock['python_tag'] != self.python_tag:
+            warning('%s was locked for %s.', self.locked, lock['python_tag'])
+
+        def fetch(package):
+            return fetch_locked(
+                self.python,
+                package,
+                join_path(wheelhouse, package['name']),
+                self.cache,
+            )
+
+        packages = lock['packages']
+        log('Fetching %d locked packages...', len(packages))
+        wheels, failures = [], []
+        results = parallel_map(
+            fetch,
+            packages,
+            max(self.jobs, LOCKED_FETCH_JOBS),
+        )
+        for package, (result, exc) in zip(packages, results):
+            if exc:
+                failures.append(exc)
+                continue
+            wheel, verified = result
+            if verified:
+                debug('Verified %s.', package['wheel'])
+            elif 'commit' in package or 'artifact_sha256' in package:
+                # Built wheels are not byte for byte reproducible, their
+                # source was pinned by commit or checked by pip instead
+                debug('Rebuilt %s from its locked source.', package['wheel'])
+            else:
+                warning('Can not verify %s.', package['wheel'])
+            wheels.append(wheel)
+        if failures:
+            report_build_failures(failures)
+            raise RuntimeError(
+                'Failed to fetch %d of %d locked packages.' %
+                (len(failures), len(packages))
+            )
+        return lock['requirements'], wheels
+
+    def export_lock(self, path):
+        '''Resolve and build all dependencies then write a lockfile pinning
+        their exact versions, commits and hashes.'''
+
+        if self.local:
+            abort('A local install can not be locked.')
+
+        path = os.path.abspath(path)
+        log('\nLocking Construct-%s to "%s".', self.version, path)
+        log('Using "%s".', self.python)
+
+        self.configure_git()
+        if self.mirror:
+            with step('Update git mirrors...'):
+                self.update_mirrors()
+
+        wheelhouse = tempfile.mkdtemp(prefix='construct_wheels_')
+        try:
+            with step('Build wheels...'):
+                requirements, wheels, _ = self.resolve_wheels(
+                    self.python,
+                    wheelhouse,
+                )
+
+            with step('Pin sources and hashes...'):
+                sources = {}
+                for requirement in [self.pip_package] + requirements:
+                    name, url, _ = parse_requirement(requirement)
+                    if url:
+                        sources[name] = url
+                results = parallel_map(
+                    lambda wheel: lock_package(self.python, wheel, sources),
+                    wheels,
+                    max(self.jobs, LOCKED_FETCH_JOBS),
+                )
+                packages = []
+                for result, exc in results:
+                    if exc:
+                        raise exc
+                    packages.append(result)
+                    log('%s %s', result['name'],
+                        result.get('commit', result['version']))
+
+                # Cache the exact wheels that were hashed so locked installs
+                # sharing this cache get identical wheels
+                if self.cache:
+                    for wheel, package in zip(wheels, packages):
+                        self.cache.put(
+                            package['requirement'],
+                            os.path.dirname(wheel),
+                        )
+
+            with step('Write lockfile...'):
+                with open(path + '.tmp', 'w') as f:
+                    json.dump(
+                        {
+                            'lockfile_version': LOCKFILE_VERSION,
+                            'version': self.version,
+                            'python_tag': self.python_tag,
+                            'requirements': requirements,
+                            'packages': packages,
+                        },
+                        f,
+                        indent=4,
+                        sort_keys=True,
+                    )
+                replace_file(path + '.tmp', path)
+        finally:
+            shutil.rmtree(wheelhouse, ignore_errors=True)
+
+        log('\nLockfile complete!')
+        log('\nInstall exactly these packages using:\n')
+        log('    install --locked %s', path)
+
+    def export_bundle(self, path):
+        '''Resolve and build all dependencies then write them along with the
+        construct scripts to a bundle for offline installs.
+
+        When locked is set the bundle contains the wheels pinned by the
+        lockfile instead.
+        '''
+
+        path = os.path.abspath(path)
+        log('\nBundling Construct-%s to "%s".', self.version, path)
+        log('Using "%s".', self.python)
+
+        self.configure_git()
+        if self.mirror:
+            with step('Update git mirrors...'):
+                self.update_mirrors()
+
+        wheelhouse = tempfile.mkdtemp(prefix='construct_wheels_')
+        try:
+            if self.locked:
+                with step('Fetch locked wheels...'):
+                    requirements, wheels = self.fetch_locked_wheels(
+                        wheelhouse,
+                    )
+            else:
+                with step('Build wheels...'):
+                    requirements, wheels, _ = self.resolve_wheels(
+                        self.python,
+                        wheelhouse,
+                    )
+
+            with step('Build pip wheel...'):
+                pip_wheels = []
+                try:
+                    pip_dir = fetch_wheels(
+                        self.python,
+                        'pip',
+                        join_path(wheelhouse, 'pip'),
+                        self.cache,
+                        '--no-deps',
+                    )
+                    pip_wheels = find_wheels(pip_dir)
+                except BuildError:
+                    warning('Failed to build pip, it will not be upgraded.')
+
+            with step('Write bundle...'):
+                write_bundle(
+                    path,
+                    {
+                        'version': self.version,
+                        'python_tag': self.python_tag,
+                        'requirements': requirements,
+                    },
+                    {
+                        'wheels': wheels,
+                        'pip': pip_wheels,
+                        'bin': [
+                            join_path(THIS_BIN, script)
+                            for script in sorted(os.listdir(THIS_BIN))
+                        ],
+                    },
+                )
+        finally:
+            shutil.rmtree(wheelhouse, ignore_errors=True)
+
+        log('\nBundle complete!')
+        log('\nInstall it on machines without network access using:\n')
+        log('    install --bundle-in %s', path)
+
+    def windows_steps(self, graph):
+        '''Add Windows specific install steps to a StepGraph.'''
+
+        if is_elevated():
+            graph.add(
+                'set_acls',
+                lambda: set_user_acls(self.install_path),
+                'Setting windows acls...',
+                requires=['activate'],
+            )
+
+        if self.no_profile:
+            return
+
+        # Modify system PATH to include construct install directory
+        def add_to_path():
+            system_path = _win_get_env('PATH')
+            if self.where not in system_path.split(';'):
+                if is_elevated():
+                    execute_after(
+                        'setx /M PATH "%s;%s"' % (self.where, system_path)
+                    )
+            execute_after('set "PATH=%s;%%PATH%%"' % self.where)
+
+        graph.add(
+            'add_to_path',
+            add_to_path,
+            'Adding %s to system PATH...', self.where,
+            requires=['activate'],
+        )
+
+        if self.config:
+            def set_config():
+                if is_elevated():
+                    execute_after(
+                        'setx /M CONSTRUCT_CONFIG "%s"' % self.config
+                    )
+                execute_after('set "CONSTRUCT_CONFIG=%s"' % self.config)
+
+            graph.add(
+                'set_config',
+                set_config,
+                'Setting CONSTRUCT_CONFIG to %s...', self.config,
+                requires=['add_to_path'],
+            )
+
+    def mac_steps(self, graph):
+        '''Add Mac specific install steps to a StepGraph.'''
+
+        self.unix_steps(graph)
+        # TODO: Create Application
+        # TODO: Modify plist
+
+    def unix_steps(self, graph):
+        '''Add Linux / Unix install steps to a StepGraph.'''
+
+        if self.no_profile:
+            return
+
+        export_cmd = 'export PATH=%s:$PATH' % self.where
+        source_cmd = 'source %s/construct.sh' % self.where
+        config_cmd = None
+        if self.config:
+            config_cmd = 'export CONSTRUCT_CONFIG=%s' % self.config
+
+        if is_elevated():
+            bash_profile_path = '/etc/profile'
+        else:
+            bash_profile_path = os.path.expanduser('~/.profile')
+
+        def add_to_profile():
+            if update_profile(
+                bash_profile_path,
+                export_cmd,
+                source_cmd,
+                config_cmd,
+            ):
+                log('Updated %s.', bash_profile_path)
+            else:
+                log('%s is up to date.', bash_profile_path)
+
+        # The profile only refers to where so it does not wait for the install
+        graph.add(
+            'update_profile',
+            add_to_profile,
+            'Add construct to bash profile...',
+            requires=['ensure_dirs'],
+        )
+        graph.add(
+            'add_to_path',
+            lambda: execute_after(export_cmd),
+            'Adding %s to PATH...', self.where,
+            requires=['activate'],
+        )
+        graph.add(
+            'source_scripts',
+            lambda: execute_after(source_cmd),
+            'Sourcing construct.sh...',
+            requires=['add_to_path'],
+        )
+
+        if self.config:
+            def set_config():
+                log('Setting CONSTRUCT_CONFIG to %s' % self.config)
+                execute_after(config_cmd)
+
+            graph.add(
+                'set_config',
+                set_config,
+                'Setting CONSTRUCT_CONFIG to %s', self.config,
+                requires=['source_scripts'],
+            )
+
+
+# Fleet Installs
+FLEET_LOG = 'install_fleet.log'
+FLEET_OPTIONS = (
+    # Options handled by the fleet itself, not passed to each target
+    'targets',
+    'parallel',
+    'where',
+    'bundle_in',
+    'bundle_out',
+    'lock_out',
+    'local',
+    'no_profile',
+)
+
+
+def read_targets(path):
+    '''Read install roots from a file, one per line.
+
+    Blank lines and lines starting with # are ignored.
+    '''
+
+    targets = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            target = join_path(os.path.abspath(os.path.expanduser(line)))
+            if target not in targets:
+                targets.append(target)
+    return targets
+
+
+def child_argv(parser, options, skip=FLEET_OPTIONS):
+    '''Build the command line args of a child install from parsed options.
+
+    Options left at their defaults and options whose dest is in skip are
+    not passed. The args are built from the parsed options rather than
+    sys.argv, so abbreviated options can not slip through to the child.
+    '''
+
+    argv = []
+    for action in parser._actions:
+        if not action.option_strings or action.dest in skip:
+            continue
+        value = options.get(action.dest, action.default)
+        if value is None or value == action.default:
+            continue
+        if action.nargs == 0:
+            argv.append(action.option_strings[0])  # A flag
+        else:
+            argv.extend([action.option_strings[0], str(value)])
+    return argv
+
+
+def install_target(target, bundle, argv, env):
+    '''Install a bundle to target in a child process.
+
+    The child leaves the bash profile, PATH and CONSTRUCT_CONFIG alone.
+    The child runs with env, a copy of the environment taken before the
+    parent changed it. Output is written to a log file in the target.
+    Returns a tuple of (success, seconds, log_path).
+    '''
+
+    ensure_exists(target)
+    log_path = join_path(target, FLEET_LOG)
+    cmd = [sys.executable, os.path.abspath(__file__)] + argv + [
+        '--where', target,
+        '--bundle-in', bundle,
+        '--ignore-prompts',
+        '--no-profile',  # Concurrent targets would race on one profile
+    ]
+    env = dict(env)
+    env.pop('SCRIM_PATH', None)  # Profile commands are meaningless here
+
+    start = time.time()
+    with open(log_path, 'w') as f:
+        command = Command(cmd, stdout=f, stderr=STDOUT, env=env)
+        command.run()
+    return command.returncode == 0, time.time() - start, log_path
+
+
+def install_fleet(installer, targets, parallel, argv):
+    '''Resolve and build dependencies once then install them to all targets.
+
+    An existing bundle is used instead when the installer has one. At most
+    parallel targets are installed at the same time. Returns True
+    if every target was installed.
+    '''
+
+    if not targets:
+        abort('No install targets given.')
+
+    log('\nInstalling Construct-%s to %d targets.', installer.version,
+        len(targets))
+    # Building the bundle redirects git in os.environ, each child configures
+    # git itself from its own options
+    env = os.environ.copy()
+    bundle_dir = tempfile.mkdtemp(prefix='construct_fleet_')
+    if installer.bundle_in:
+        bundle = os.path.abspath(installer.bundle_in)
+    else:
+        bundle = join_path(
+            bundle_dir,
+            'construct-%s.tar.gz' % installer.version,
+        )
+    done = [0]
+    lock = threading.Lock()
+
+    def install(target):
+        log('Installing to %s...', target)
+        try:
+            result = install_target(target, bundle, argv, env)
+        except Exception as e:
+            result = False, 0, str(e)
+        with lock:
+            done[0] += 1
+            log(
+                '[%d/%d] %s %s in %.1fs',
+                done[0], len(targets), target,
+                'OK!' if result[0] else 'FAILED', result[1],
             )
+        return result
+
+    try:
+        if not installer.bundle_in:
+            installer.export_bundle(bundle)
+        with step('Install to %d targets...', len(targets)):
+            results = [
+                result for result, _ in
+                parallel_map(install, targets, parallel)
+            ]
+    finally:
+        shutil.rmtree(bundle_dir, ignore_errors=True)
+
+    width = max(len(target) for target in targets + ['Target'])
+    row = '%-' + str(width) + 's  %-6s  %8s  %s'
+    log('\n' + row, 'Target', 'Status', 'Seconds', 'Log')
+    for target, (success, seconds, log_path) in zip(targets, results):
+        log(
+            row, target, 'ok' if success else 'failed',
+            '%.1f' % seconds, log_path,
+        )
+
+    failed = len([r for r in results if not r[0]])
+    if failed:
+        log('\n%d of %d targets failed.', failed, len(targets))
+        return False
+    log('\nFleet install complete!')
+    return True
+
+
+# Startup Profiles
+STARTUP_PROFILE = 'startup_profile.json'
+PROFILE_SCRIPT = '''
+import atexit, os, sys, time
+from importlib.machinery import PathFinder
+
+stats = {'path_searches': 0, 'path_search_time': 0.0}
+_find_spec = PathFinder.find_spec.__func__
+
+
+def find_spec(cls, fullname, path=None, target=None):
+    if path is not None:
+        return _find_spec(cls, fullname, path, target)
+    start = time.perf_counter()
+    try:
+        return _find_spec(cls, fullname, path, target)
+    finally:
+        stats['path_searches'] += 1
+        stats['path_search_time'] += time.perf_counter() - start
+
+
+def save():
+    import json
+    stats['sys_path'] = len(sys.path)
+    with open(os.environ['CONSTRUCT_PROFILE_OUT'], 'w') as f:
+        json.dump(stats, f)
+
+
+PathFinder.find_spec = classmethod(find_spec)
+atexit.register(save)
+module, _, attrs = sys.argv[1].partition(':')
+sys.argv = sys.argv[2:]
+obj = __import__(module, fromlist=['__name__'])
+for attr in attrs.split('.'):
+    obj = getattr(obj, attr)
+sys.exit(obj())
+'''
+OTHER_PACKAGES = '<stdlib and site>'
+IMPORTTIME_PATTERN = re.compile(
+    r'^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)\s*$'
+)
+
 
-        with step('Adding %s to PATH...', self.where):
-            execute_after(export_cmd)
+def find_entry_point(lib, name):
+    '''Find the module:function a console script in lib runs.'''
+
+    for dist_info in sorted(os.listdir(lib)):
+        if not dist_info.endswith('.dist-info'):
+            continue
+        entry_points = join_path(lib, dist_info, 'entry_points.txt')
+        if not os.path.isfile(entry_points):
+            continue
+        section = None
+        with open(entry_points, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('['):
+                    section = line.strip('[]')
+                elif section == 'console_scripts' and '=' in line:
+                    script, target = line.split('=', 1)
+                    if script.strip() == name:
+                        return target.split('[')[0].strip()
+
+
+def get_lib_packages(install_path):
+    '''Get the names of the top level modules and packages in an installed
+    version's lib and lib.zip.'''
+
+    names = os.listdir(join_path(install_path, 'lib'))
+    lib_zip = join_path(install_path, LIB_ZIP)
+    if os.path.isfile(lib_zip):
+        with zipfile.ZipFile(lib_zip) as archive:
+            names.extend(name.split('/')[0] for name in archive.namelist())
+    return set(
+        name.split('.')[0] for name in names
+        if not name.endswith(('.dist-info', '.egg-info', '.pth'))
+    )
 
-        with step('Sourcing construct.sh...'):
-            execute_after(source_cmd)
 
-        if self.config:
-            with step('Setting CONSTRUCT_CONFIG to %s', self.config):
-                log('Setting CONSTRUCT_CONFIG to %s' % self.config)
-                execute_after(config_cmd)
+def parse_importtime(output):
+    '''Parse the output of python -X importtime.
 
+    Returns a list of dicts containing the name, depth and the self and
+    cumulative import time in microseconds of each module in import order.
+    '''
 
-def main():
+    imports = []
+    for line in output.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        if match:
+            self_us, cumulative, indent, name = match.groups()
+            imports.append({
+                'name': name,
+                'depth': (len(indent) - 1) // 2,
+                'self': int(self_us),
+                'cumulative': int(cumulative),
+            })
+    return imports
+
+
+def summarize_imports(imports, lib_packages):
+    '''Aggregate import times by top level package.
+
+    Packages not in lib_packages, like the standard library, are grouped
+    under OTHER_PACKAGES. The cumulative time of a package only counts
+    imports of it that were not made by the same package, so it is not
+    counted twice.
+    '''
 
-    if not is_available('git --version'):
-        abort(
-            'Git is required to install construct.\n\n'
-            'Download it from https://git-scm.com/.'
+    packages = {}
+    stack = []
+    # importtime lists a module after its imports, reverse it so parents
+    # are seen before their children
+    for module in reversed(imports):
+        package = module['name'].split('.')[0]
+        if package not in lib_packages:
+            package = OTHER_PACKAGES
+        del stack[module['depth']:]
+        summary = packages.setdefault(
+            package,
+            {'modules': 0, 'self': 0, 'cumulative': 0},
+        )
+        summary['modules'] += 1
+        summary['self'] += module['self']
+        if package not in stack:
+            summary['cumulative'] += module['cumulative']
+        stack.append(package)
+    return packages
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def profile_startup(python, install_path, entry_point, args):
+    '''Run an entry point of an installed version with import tracing.
+
+    Returns a tuple of (imports, path stats, wall seconds, returncode).
+    '''
+
+    lib = join_path(install_path, 'lib')
+    bin = join_path(install_path, 'bin')
+    env = os.environ.copy()
+    env['PATH'] = os.pathsep.join([bin, env.get('PATH', '')])
+    env['PYTHONPATH'] = os.pathsep.join(
+        [join_path(install_path, LIB_ZIP), lib, env.get('PYTHONPATH', '')]
+    )
+
+    tmp_dir = tempfile.mkdtemp(prefix='construct_profile_')
+    try:
+        script = join_path(tmp_dir, 'profile_startup.py')
+        env['CONSTRUCT_PROFILE_OUT'] = join_path(tmp_dir, 'stats.json')
+        with open(script, 'w') as f:
+            f.write(PROFILE_SCRIPT)
+
+        cmd = [python, '-X', 'importtime', script, entry_point] + args
+        debug('%s', ' '.join(cmd))
+        start = time.time()
+        proc = Popen(cmd, stdout=PIPE, stderr=PIPE, env=env)
+        _, stderr = proc.communicate()
+        wall = time.time() - start
+        if not isinstance(stderr, str):
+            stderr = stderr.decode('utf-8', 'replace')
+
+        stats = {'path_searches': 0, 'path_search_time': 0, 'sys_path': 0}
+        if os.path.isfile(env['CONSTRUCT_PROFILE_OUT']):
+            with open(env['CONSTRUCT_PROFILE_OUT'], 'r') as f:
+                stats = json.load(f)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return parse_importtime(stderr), stats, wall, proc.returncode
+
+
+# Version Inventory
+SCAN_JOBS = 8  # Versions scanned or removed at the same time
+
+
+def find_versions(where):
+    '''List the names of the versions installed in where.'''
+
+    versions = []
+    for name in sorted(os.listdir(where)):
+        path = join_path(where, name)
+        if name.startswith('.') or os.path.islink(path):
+            continue
+        if os.path.isdir(join_path(path, 'python')) or os.path.isfile(
+            join_path(path, INSTALL_MANIFEST)
+        ):
+            versions.append(name)
+    return versions
+
+
+def scan_version(path):
+    '''Stat every file of an installed version.
+
+    Returns a dict containing the version's size in bytes, the last time any
+    of its files was accessed or modified and a dict mapping the (device,
+    inode) of each file to its size, its total number of hardlinks and the
+    number of those found in the version. Hardlinks within the version are
+    counted once and symlinks are skipped.
+    '''
+
+    inodes = {}
+    used = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                stat = os.lstat(os.path.join(root, f))
+            except OSError:
+                continue  # Removed while scanning
+            if not S_ISREG(stat.st_mode):
+                continue
+            inode = (stat.st_dev, stat.st_ino)
+            links = inodes[inode][2] + 1 if inode in inodes else 1
+            inodes[inode] = (stat.st_size, stat.st_nlink, links)
+            used = max(used, stat.st_atime, stat.st_mtime)
+    return {
+        'size': sum(size for size, _, _ in inodes.values()),
+        'used': used,
+        'inodes': inodes,
+    }
+
+
+def reclaimable_size(scans):
+    '''Get the bytes freed by removing the scanned versions.
+
+    A file is only freed when all of its hardlinks are inside those versions,
+    files also linked into the store, a virtualenv template or any other
+    version are not counted.
+    '''
+
+    links = collections.Counter()
+    inodes = {}
+    for scan in scans:
+        for inode, (size, nlink, count) in scan['inodes'].items():
+            links[inode] += count
+            inodes[inode] = (size, nlink)
+    return sum(
+        size for inode, (size, nlink) in inodes.items()
+        if links[inode] >= nlink
+    )
+
+
+def get_versions(where, jobs=SCAN_JOBS):
+    '''Scan the versions installed in where concurrently.
+
+    Returns a list of dicts containing each version's name, path, size in
+    bytes, the bytes it shares with other versions, the store or a template
+    through hardlinks, the bytes only it uses, the time it was last used,
+    whether the current or previous symlinks point to it and the inodes of
+    its files.
+    '''
+
+    names = find_versions(where)
+    paths = [join_path(where, name) for name in names]
+    scans = []
+    for scan, exc in parallel_map(scan_version, paths, jobs):
+        if exc:
+            raise exc
+        scans.append(scan)
+
+    active = {}
+    for link in ('current', 'previous'):
+        path = join_path(where, link)
+        if os.path.exists(path):
+            active[link] = join_path(os.path.realpath(path))
+
+    versions = []
+    for name, path, scan in zip(names, paths, scans):
+        unique = reclaimable_size([scan])
+        versions.append({
+            'name': name,
+            'path': path,
+            'size': scan['size'],
+            'shared': scan['size'] - unique,
+            'unique': unique,
+            'used': scan['used'],
+            'current': active.get('current') == path,
+            'previous': active.get('previous') == path,
+            'inodes': scan['inodes'],
+        })
+    return versions
+
+
+def select_prunable(versions, keep=None, older_than=None, now=None):
+    '''Select the versions a prune removes.
+
+    The keep most recently used versions are kept, and when older_than is
+    given only versions unused for that many days are removed. The current
+    and previous versions are never selected.
+    '''
+
+    versions = sorted(versions, key=lambda v: v['used'], reverse=True)
+    if keep is not None:
+        versions = versions[keep:]
+    if older_than is not None:
+        cutoff = (now or time.time()) - older_than * 24 * 60 * 60
+        versions = [v for v in versions if v['used'] < cutoff]
+    return [v for v in versions if not v['current'] and not v['previous']]
+
+
+def remove_version(where, path):
+    '''Remove an installed version unless current or previous point to it.
+
+    The version is first moved to the staging directory so that it is never
+    visible half removed.
+    '''
+
+    for link in ('current', 'previous'):
+        link_path = join_path(where, link)
+        if (
+            os.path.exists(link_path)
+            and join_path(os.path.realpath(link_path)) == path
+        ):
+            raise RuntimeError('%s is the %s version.' % (path, link))
+
+    staging = join_path(where, STAGING_DIR)
+    if not os.path.isdir(staging):
+        try:
+            os.makedirs(staging)
+        except OSError:
+            pass  # Created by another thread
+    trash = join_path(
+        staging,
+        '%s.prune-%d' % (os.path.basename(path), time.time()),
+    )
+    debug('Moving %s to %s', path, trash)
+    os.rename(path, trash)
+    shutil.rmtree(trash)
+
+
+def format_size(size):
+    return '%.1f MB' % (size / (1024.0 * 1024.0))
+
+
+def format_time(seconds):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(seconds))
+
+
+def gc(argv):
+    '''Remove objects from the store that no installed version uses.'''
+
+    parser = argparse.ArgumentParser('construct_installer gc')
+    parser.add_argument(
+        '--where',
+        action='store',
+        help='Install directory',
+        default=DEFAULT_INSTALL_DIR
+    )
+    args = parser.parse_args(argv)
+
+    store = ObjectStore(join_path(os.path.abspath(args.where), '.store'))
+    log('Collecting garbage in %s...', store.root)
+    removed, size = store.gc()
+    log('Removed %d objects, %d MB.', removed, size // (1024 * 1024))
+
+
+def profile(argv):
+    '''Profile the startup time of an installed version's cli.'''
+
+    parser = argparse.ArgumentParser('construct_installer profile')
+    parser.add_argument(
+        '--where',
+        action='store',
+        help='Install directory',
+        default=DEFAULT_INSTALL_DIR
+    )
+    parser.add_argument(
+        '--name',
+        action='store',
+        help='Version to profile (default: current).',
+        default='current'
+    )
+    parser.add_argument(
+        '--command',
+        action='store',
+        help='Console script to run.',
+        default='construct'
+    )
+    parser.add_argument(
+        '--rounds',
+        action='store',
+        type=int,
+        help='Number of times to run the command.',
+        default=3
+    )
+    parser.add_argument(
+        '--top',
+        action='store',
+        type=int,
+        help='Number of slowest modules to show.',
+        default=10
+    )
+    parser.add_argument(
+        'args',
+        nargs=argparse.REMAINDER,
+        help='Arguments passed to the command (default: -h).',
+    )
+    args = parser.parse_args(argv)
+
+    install_path = join_path(
+        os.path.realpath(join_path(os.path.abspath(args.where), args.name))
+    )
+    python = get_env_python(join_path(install_path, 'python'))
+    if not os.path.isfile(python):
+        abort('No installed version found at %s.', install_path)
+    if tuple(probe_python(python)['version_info']) < (3, 7):
+        abort('Profiling requires python 3.7 or later.')
+    entry_point = find_entry_point(
+        join_path(install_path, 'lib'),
+        args.command,
+    )
+    if not entry_point:
+        abort('No console script named %s in %s.', args.command, install_path)
+
+    cmd_args = args.args[1:] if args.args[:1] == ['--'] else args.args
+    cmd_args = cmd_args or ['-h']
+    log('\nProfiling "%s %s" in %s.', args.command, ' '.join(cmd_args),
+        install_path)
+    rounds = []
+    for i in range(max(1, args.rounds)):
+        imports, stats, wall, returncode = profile_startup(
+            python,
+            install_path,
+            entry_point,
+            cmd_args,
+        )
+        if returncode != 0:
+            warning('%s exited with %d.', args.command, returncode)
+        log('Round %d: %.0f ms', i + 1, wall * 1000)
+        rounds.append((imports, stats, wall))
+
+    # Use the median of each module's import time across all rounds
+    times = {}
+    for imports, _, _ in rounds:
+        for module in imports:
+            times.setdefault(module['name'], []).append(module)
+    imports = []
+    for module in rounds[0][0]:
+        samples = times[module['name']]
+        imports.append({
+            'name': module['name'],
+            'depth': module['depth'],
+            'self': median([m['self'] for m in samples]),
+            'cumulative': median([m['cumulative'] for m in samples]),
+        })
+    packages = summarize_imports(
+        imports,
+        get_lib_packages(install_path),
+    )
+    path_searches = median([stats['path_searches'] for _, stats, _ in rounds])
+    path_search_time = median(
+        [stats['path_search_time'] for _, stats, _ in rounds]
+    )
+    report = {
+        'command': [args.command] + cmd_args,
+        'wall': median([wall for _, _, wall in rounds]),
+        'import': sum(m['cumulative'] for m in imports if not m['depth']),
+        'sys_path': rounds[0][1]['sys_path'],
+        'path_searches': path_searches,
+        'path_search_time': path_search_time,
+        'packages': packages,
+        'imports': imports,
+    }
+
+    def ms(us):
+        return '%.1f' % (us / 1000.0)
+
+    log('\n%-30s %8s %8s %8s', 'Package', 'Modules', 'Self', 'Total')
+    for name, summary in sorted(
+        packages.items(),
+        key=lambda item: item[1]['cumulative'],
+        reverse=True,
+    ):
+        log(
+            '%-30s %8d %8s %8s',
+            name, summary['modules'],
+            ms(summary['self']), ms(summary['cumulative']),
+        )
+
+    log('\nSlowest modules (self ms):')
+    slowest = sorted(imports, key=lambda m: m['self'], reverse=True)
+    for module in slowest[:args.top]:
+        log('    %8s  %s', ms(module['self']), module['name'])
+
+    log(
+        '\nsys.path: %d entries searched %d times in %.1f ms.',
+        report['sys_path'], path_searches, path_search_time * 1000,
+    )
+    log(
+        'Imports: %s ms of %.0f ms wall time.',
+        ms(report['import']), report['wall'] * 1000,
+    )
+
+    report_path = join_path(install_path, STARTUP_PROFILE)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=4, sort_keys=True)
+    log('\nStartup profile written to %s.', report_path)
+
+
+def rollback(argv):
+    '''Point current back at the version it pointed to before the last
+    install.'''
+
+    parser = argparse.ArgumentParser('construct_installer rollback')
+    parser.add_argument(
+        '--where',
+        action='store',
+        help='Install directory',
+        default=DEFAULT_INSTALL_DIR
+    )
+    args = parser.parse_args(argv)
+
+    where = os.path.abspath(args.where)
+    current = join_path(where, 'current')
+    previous = join_path(where, 'previous')
+    if not os.path.exists(previous):
+        abort('No previous version to roll back to in %s.', where)
+
+    target = join_path(os.path.realpath(previous))
+    active = join_path(os.path.realpath(current))
+    update_symlink(target, current)
+    update_symlink(active, previous)
+    log('Rolled back from %s to %s.', active, target)
+    log('Run rollback again to undo.')
+
+
+def list_versions(argv):
+    '''List the installed versions and their disk usage.'''
+
+    parser = argparse.ArgumentParser('construct_installer list')
+    parser.add_argument(
+        '--where',
+        action='store',
+        help='Install directory',
+        default=DEFAULT_INSTALL_DIR
+    )
+    parser.add_argument(
+        '--jobs',
+        action='store',
+        type=int,
+        help='Number of versions to scan at the same time.',
+        default=SCAN_JOBS
+    )
+    args = parser.parse_args(argv)
+
+    where = os.path.abspath(args.where)
+    if not os.path.isdir(where):
+        abort('No install directory at %s.', where)
+    versions = get_versions(where, args.jobs)
+    if not versions:
+        log('No versions installed in %s.', where)
+        return
+
+    log('\nVersions in %s\n', where)
+    row = '%-9s %-20s %10s %10s %10s  %s'
+    log(row, '', 'NAME', 'SIZE', 'UNIQUE', 'SHARED', 'LAST USED')
+    for version in versions:
+        status = ''
+        if version['current']:
+            status = 'current'
+        elif version['previous']:
+            status = 'previous'
+        log(
+            row,
+            status,
+            version['name'],
+            format_size(version['size']),
+            format_size(version['unique']),
+            format_size(version['shared']),
+            format_time(version['used']),
         )
+    log(
+        '\n%d versions, %s unique.',
+        len(versions),
+        format_size(sum(version['unique'] for version in versions)),
+    )
+
+
+def prune(argv):
+    '''Remove installed versions by age or by keeping the most recently
+    used.'''
+
+    parser = argparse.ArgumentParser('construct_installer prune')
+    parser.add_argument(
+        '--where',
+        action='store',
+        help='Install directory',
+        default=DEFAULT_INSTALL_DIR
+    )
+    parser.add_argument(
+        '--keep',
+        action='store',
+        type=int,
+        help='Number of most recently used versions to keep.',
+        default=None
+    )
+    parser.add_argument(
+        '--older-than',
+        action='store',
+        type=float,
+        help='Only remove versions unused for this many days.',
+        default=None
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Show the versions that would be removed.',
+        default=False
+    )
+    parser.add_argument(
+        '--jobs',
+        action='store',
+        type=int,
+        help='Number of versions to scan and remove at the same time.',
+        default=SCAN_JOBS
+    )
+    args = parser.parse_args(argv)
+
+    if args.keep is None and args.older_than is None:
+        abort('Pass --keep or --older-than to choose versions to prune.')
+    where = os.path.abspath(args.where)
+    if not os.path.isdir(where):
+        abort('No install directory at %s.', where)
+
+    versions = select_prunable(
+        get_versions(where, args.jobs),
+        args.keep,
+        args.older_than,
+    )
+    if not versions:
+        log('No versions to prune in %s.', where)
+        return
+
+    # Files shared only by the removed versions are freed too
+    freed = reclaimable_size(versions)
+    if args.dry_run:
+        log('\nWould remove %d versions, %s.', len(versions),
+            format_size(freed))
+        for version in versions:
+            log('    %s, last used %s', version['name'],
+                format_time(version['used']))
+        return
+
+    log('\nRemoving %d versions...', len(versions))
+    results = parallel_map(
+        lambda version: remove_version(where, version['path']),
+        versions,
+        args.jobs,
+    )
+    removed = []
+    for version, (_, exc) in zip(versions, results):
+        if exc:
+            error('Failed to remove %s: %s', version['name'], exc)
+        else:
+            log('    Removed %s', version['name'])
+            removed.append(version)
+    freed = reclaimable_size(removed)
+
+    # Objects only linked into the removed versions are freed by gc
+    store = ObjectStore(join_path(where, '.store'))
+    if os.path.isdir(store.objects):
+        objects, size = store.gc()
+        debug('Removed %d objects from %s.', objects, store.root)
+        freed += size
+    log('Freed %s.', format_size(freed))
+
+
+COMMANDS = {
+    'gc': gc,
+    'list': list_versions,
+    'profile': profile,
+    'prune': prune,
+    'rollback': rollback,
+}
+
+
+def main():
+
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        return COMMANDS[sys.argv[1]](sys.argv[2:])
 
     parser = argparse.ArgumentParser('construct_installer', add_help=True)
     parser.add_argument(
         '--version',
         required=False,
         action='store',
-        default=DEFAULT_VERSION
+        default=None,
     )
     parser.add_argument(
         '--python',
@@ -615,6 +5231,158 @@ def main():
          help='Do not request user input.',
          default=False,
     )
+    parser.add_argument(
+        '--jobs',
+         action='store',
+         type=int,
+         help='Number of packages to build concurrently.',
+         default=DEFAULT_JOBS,
+    )
+    parser.add_argument(
+        '--cache',
+         action='store',
+         help='Wheel cache directory (default: <where>/.cache/wheels).',
+         default=None,
+    )
+    parser.add_argument(
+        '--cache-size',
+         action='store',
+         type=int,
+         help='Maximum size of the wheel cache in megabytes.',
+         default=DEFAULT_CACHE_SIZE,
+    )
+    parser.add_argument(
+        '--no-cache',
+         action='store_true',
+         help='Do not use the wheel cache.',
+         default=False,
+    )
+    parser.add_argument(
+        '--bundle-out',
+         action='store',
+         help='Write an offline install bundle instead of installing.',
+         default=None,
+    )
+    parser.add_argument(
+        '--bundle-in',
+         action='store',
+         help='Install from an offline bundle without network access.',
+         default=None,
+    )
+    parser.add_argument(
+        '--dedupe',
+         action='store_true',
+         help='Store lib files once in <where>/.store and hardlink them.',
+         default=False,
+    )
+    parser.add_argument(
+        '--incremental',
+         action='store_true',
+         help='Only install packages that changed since the current version.',
+         default=False,
+    )
+    parser.add_argument(
+        '--trace',
+         action='store_true',
+         help='Write a Chrome trace event file next to the install report.',
+         default=False,
+    )
+    parser.add_argument(
+        '--venv-template',
+         action='store_true',
+         help='Clone the virtualenv from a template built once per python.',
+         default=False,
+    )
+    parser.add_argument(
+        '--bytecode',
+         action='store',
+         choices=BYTECODE_MODES,
+         help='How to precompile lib, none to skip.',
+         default=DEFAULT_BYTECODE,
+    )
+    parser.add_argument(
+        '--zip-lib',
+         action='store_true',
+         help='Move pure python packages to lib.zip to reduce file lookups.',
+         default=False,
+    )
+    parser.add_argument(
+        '--no-resume',
+         action='store_true',
+         help='Run every step again instead of resuming a failed install.',
+         default=False,
+    )
+    parser.add_argument(
+        '--verify',
+         action='store_true',
+         help='Hash the files of an existing install to check it is '
+              'unchanged before skipping it.',
+         default=False,
+    )
+    parser.add_argument(
+        '--sources',
+         action='store',
+         help='JSON file mapping git url prefixes to their replacements.',
+         default=None,
+    )
+    parser.add_argument(
+        '--mirror',
+         action='store_true',
+         help='Install git dependencies from mirrors in <where>/.cache/git.',
+         default=False,
+    )
+    parser.add_argument(
+        '--smoke-test',
+         action='store_true',
+         help='Import each dependency and run cons -h before activating.',
+         default=False,
+    )
+    parser.add_argument(
+        '--latency-budget',
+         action='store',
+         type=float,
+         help='Seconds each smoke test may take (default: %(default)s).',
+         default=DEFAULT_LATENCY_BUDGET,
+    )
+    parser.add_argument(
+        '--lock-out',
+         action='store',
+         help='Write a lockfile of exact versions and hashes instead of '
+              'installing.',
+         default=None,
+    )
+    parser.add_argument(
+        '--locked',
+         action='store',
+         help='Install the packages pinned by a lockfile.',
+         default=None,
+    )
+    parser.add_argument(
+        '--targets',
+         action='store',
+         help='File listing install roots to install to from one build.',
+         default=None,
+    )
+    parser.add_argument(
+        '--parallel',
+         action='store',
+         type=int,
+         help='Number of targets to install to at the same time.',
+         default=4,
+    )
+    parser.add_argument(
+        '--no-profile',
+         action='store_true',
+         help='Do not add construct to the bash profile or PATH.',
+         default=False,
+    )
+    parser.add_argument(
+        '--timeout',
+         action='store',
+         type=float,
+         help='Seconds a command may run before it is killed.',
+         default=None,
+    )
     parser.add_argument(
         '--debug',
          action='store_true',
@@ -624,6 +5392,7 @@ def main():
 
 
     args = parser.parse_args()
+    options = dict(vars(args))
     args.python = escape(args.python)
 
     if args.debug:
@@ -631,8 +5400,36 @@ def main():
         _log.setLevel(logging.DEBUG)
         VERBOSE = True
     delattr(args, 'debug')
+    if args.timeout:
+        global COMMAND_TIMEOUT
+        COMMAND_TIMEOUT = args.timeout
+    delattr(args, 'timeout')
+    bundle_out = args.bundle_out
+    delattr(args, 'bundle_out')
+    lock_out = args.lock_out
+    delattr(args, 'lock_out')
+    targets = args.targets
+    parallel = args.parallel
+    delattr(args, 'targets')
+    delattr(args, 'parallel')
+
+    if args.locked and args.version is None:
+        args.version = read_lockfile(args.locked)['version']
+    if args.bundle_in:
+        if args.version is None:
+            args.version = read_bundle_manifest(args.bundle_in)['version']
+    elif not is_available('git --version'):
+        abort(
+            'Git is required to install construct.\n\n'
+            'Download it from https://git-scm.com/.'
+        )
+    args.version = args.version or DEFAULT_VERSION
 
-    if not is_available(args.python + ' -c "import pip"'):
+    try:
+        probe = probe_python(args.python)
+    except OSError:
+        abort('Failed to run python "%s".', args.python)
+    if not probe['pip']:
         abort(
             'pip is required to install construct.\n\n'
             'Get it from https://pip.pypa.io/en/stable/installing/.'
@@ -650,7 +5447,21 @@ def main():
                 log('Abort.')
                 sys.exit()
 
-    Installer(**vars(args)).run()
+    installer = Installer(**vars(args))
+    if targets:
+        if not install_fleet(
+            installer,
+            read_targets(targets),
+            parallel,
+            child_argv(parser, options),
+        ):
+            sys.exit(1)
+    elif bundle_out:
+        installer.export_bundle(bundle_out)
+    elif lock_out:
+        installer.export_lock(lock_out)
+    else:
+        installer.run()
 
 
 if __name__ == "__main__":